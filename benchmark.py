@@ -0,0 +1,202 @@
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy
+from PIL import Image, ImageSequence
+
+from helper.options import parse_benchmark_options
+from helper.synthetic_pack import PACK_SHAPE_ANIMATED, SyntheticPack, generate_pack
+
+BENCHMARK_VERSION = 1
+CONVERT_RSP = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'convert_rsp.py')
+
+options = parse_benchmark_options()
+
+
+def get_commit():
+    '''
+    :return: Hash of the checked out commit, or None outside of a git checkout
+    '''
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(CONVERT_RSP), stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, universal_newlines=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_exit_code(status):
+    '''
+    :param status: Wait status from os.wait4
+    :return: Exit code of the process, or minus the signal that killed it, like subprocess does
+    '''
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def run_convert_rsp(pack: SyntheticPack, output_path, trace_file=None, reference=False):
+    '''
+    Renders every model of the pack into a fresh output folder.
+    :param trace_file: Profile the run into this file (see convert_rsp.py --profile)
+    :param reference: Render one icon per frame, without a texture atlas, whatever the options say
+    :return: Tuple (wall time in seconds, peak resident memory in kB of the renderer or any of its workers, or None
+    where os.wait4 isn't available)
+    '''
+    shutil.rmtree(output_path, ignore_errors=True)
+    args = [sys.executable, CONVERT_RSP, '-mo', '-mf', pack.map_file, '-si', str(options.size), '-j', str(options.jobs),
+            '-tl', str(1 if reference else options.tiles), '-o', output_path]
+    if pack.shape == PACK_SHAPE_ANIMATED:
+        args += ['-am', 'apng']
+    if options.texture_atlas and not reference:
+        args += ['-ta']
+    if trace_file is not None:
+        args += ['-pf', trace_file]
+    args += [pack.rsp_path, pack.mc_base_rsp_path]
+
+    log_file = os.path.join(os.path.dirname(output_path), 'convert_rsp.log')
+    with open(log_file, 'w') as log:
+        start = time.perf_counter()
+        process = subprocess.Popen(args, stdout=log, stderr=subprocess.STDOUT)
+        if hasattr(os, 'wait4'):
+            # wait4 rather than wait, for the resource usage of the renderer and the workers it reaped
+            _, status, usage = os.wait4(process.pid, 0)
+            seconds = time.perf_counter() - start
+            process.returncode = get_exit_code(status)
+            peak_rss = usage.ru_maxrss
+        else:
+            process.wait()
+            seconds = time.perf_counter() - start
+            peak_rss = None
+    if process.returncode != 0:
+        raise Exception(f'{" ".join(args)} exited with {process.returncode}; see {log_file}')
+
+    return seconds, peak_rss
+
+
+def get_frames(image_file):
+    with Image.open(image_file) as image:
+        return [numpy.asarray(frame.convert('RGBA')) for frame in ImageSequence.Iterator(image)]
+
+
+def get_differing_icons(output_path, reference_path):
+    '''
+    :return: Sorted list of the names of the icons in output_path with any pixel different from the icon of the same
+    name in reference_path
+    '''
+    differing = []
+    for name in sorted(os.listdir(reference_path)):
+        if not name.endswith('.png'):
+            continue
+        output_file = os.path.join(output_path, name)
+        if not os.path.exists(output_file):
+            differing.append(name)
+            continue
+        frames = get_frames(output_file)
+        reference_frames = get_frames(os.path.join(reference_path, name))
+        if len(frames) != len(reference_frames) or \
+                any(not numpy.array_equal(frame, reference) for frame, reference in zip(frames, reference_frames)):
+            differing.append(name)
+    return differing
+
+
+def benchmark_pack(pack: SyntheticPack, work_path):
+    output_path = os.path.join(work_path, 'out')
+    runs = [run_convert_rsp(pack, output_path) for _ in range(options.repeat)]
+    seconds = min(seconds for seconds, _ in runs)
+
+    result = {
+        'models': pack.num_models,
+        'renders': pack.num_renders,
+        'seconds': seconds,
+        'runs': [seconds for seconds, _ in runs],
+        'models_per_second': pack.num_models / seconds,
+        'renders_per_second': pack.num_renders / seconds,
+        'peak_rss_kb': None if runs[0][1] is None else max(peak_rss for _, peak_rss in runs),
+    }
+
+    if options.check:
+        reference_path = os.path.join(work_path, 'reference')
+        run_convert_rsp(pack, reference_path, reference=True)
+        result['differing_icons'] = get_differing_icons(output_path, reference_path)
+        if len(result['differing_icons']) > 0:
+            print(f'{len(result["differing_icons"])} of {pack.num_renders} icons differ from the ones rendered with one '
+                  f'tile and no texture atlas: {", ".join(result["differing_icons"])}', file=sys.stderr)
+
+    if options.stages:
+        # Profiling slows the run down, so it isn't one of the timed ones
+        trace_file = os.path.join(work_path, 'trace.json')
+        run_convert_rsp(pack, output_path, trace_file)
+        with open(trace_file, 'r') as trace:
+            result['stages'] = json.load(trace)['otherData']['summary']
+
+    return result
+
+
+def compare(results, baseline):
+    if baseline.get('settings') != results['settings']:
+        print('The baseline was run with different settings: ' + json.dumps(baseline.get('settings')), file=sys.stderr)
+    for shape, result in results['results'].items():
+        baseline_result = baseline['results'].get(shape)
+        if baseline_result is None:
+            continue
+        change = result['models_per_second'] / baseline_result['models_per_second'] - 1
+        print(f'{shape}: {result["models_per_second"]:.1f} models/s, {baseline_result["models_per_second"]:.1f} '
+              f'in {baseline.get("commit") or "baseline"} ({change:+.1%})', file=sys.stderr)
+
+
+def main():
+    work_path = options.work_path
+    if work_path is None:
+        work_path = tempfile.mkdtemp(prefix='rsp_benchmark_')
+
+    results = {
+        'version': BENCHMARK_VERSION,
+        'commit': get_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'settings': {
+            'models': options.models,
+            'parent_depth': options.parent_depth,
+            'elements': options.elements,
+            'frames': options.frames,
+            'overrides': options.overrides,
+            'texture_size': options.texture_size,
+            'repeat': options.repeat,
+            'jobs': options.jobs,
+            'tiles': options.tiles,
+            'size': options.size,
+            'texture_atlas': options.texture_atlas,
+        },
+        'results': {},
+    }
+
+    try:
+        for shape in options.shapes:
+            pack_path = os.path.join(work_path, shape)
+            pack = generate_pack(os.path.join(pack_path, 'pack'), shape, options.models, options.parent_depth,
+                                 options.elements, options.frames, options.overrides, options.texture_size)
+            print(f'Benchmarking {shape} ({pack.num_models} models, {pack.num_renders} renders)', file=sys.stderr)
+            results['results'][shape] = benchmark_pack(pack, pack_path)
+    finally:
+        if options.work_path is None:
+            shutil.rmtree(work_path, ignore_errors=True)
+
+    if options.output_file is not None:
+        with open(options.output_file, 'w') as output_file:
+            json.dump(results, output_file, indent=1)
+    else:
+        print(json.dumps(results, indent=1))
+
+    if options.baseline_file is not None:
+        with open(options.baseline_file, 'r') as baseline_file:
+            compare(results, json.load(baseline_file))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,32 @@
+import io
 import json
+import multiprocessing
 import os
-import subprocess
-from collections import Set
-from shutil import copyfile
-
-from helper.model import get_model_id_from_file_path, get_path_from_model_id
+import time
+from typing import Set
+
+from helper.animation import encode_animation, get_animation_file, get_animation_timeline, is_animated, \
+    render_animation
+from helper.assets import get_asset_index, get_pack_stack
+from helper.atlas import AtlasBuilder, AtlasIndex, get_icon_name
+from helper.manifest import RenderManifest, get_input_hash
+from helper.model import get_model_id_from_file_path, get_path_from_model_id, load_model_json, fill_frame_data
 from helper.options import parse_render_all_options, RENDER_OPTION_ALL
+from helper.planner import RenderPlanner
+from helper.profiling import enable_profiling, format_stage_summary, get_max_rss_kb, get_max_rss_kb_of_events, \
+    get_stage_summary, pop_events, record_memory, save_trace, stage
+from helper.scaling import downscale
+from helper.scheduler import RenderCosts, schedule_jobs
+from helper.sprites import render_sprite
+from helper.texture_atlas import build_texture_atlases
+from helper.textures import get_texture_cache
 from helper.tile_entities import TILE_ENTITIY_ID_SET
 
 options = parse_render_all_options()
+get_texture_cache().budget_bytes = options.texture_cache_mb * 1024 * 1024
+renderer = None  # Created on first use, then shared by every icon rendered in this process
+manifest = None  # RenderManifest of the previous run; only used with --incremental, by the main process
+previous_atlas = None  # AtlasIndex of the previous run; only used with --atlas and --incremental, by the main process
 
 if options.file_name_map is not None:
     with open(options.file_name_map, 'r') as file_map_file:
@@ -41,35 +59,177 @@ def get_new_file_name(filepath, suffix):
     return out_file
 
 
-def generate_icon(filename, out_names=None):
-    abs_file_name = os.path.abspath(filename)
-    print('Generating icon for file ' + abs_file_name)
+def get_render_size():
+    return options.scale_size if options.downscale else options.output_size
+
 
-    main_script_output_size = options.scale_size if options.downscale_ffmpeg else options.output_size
-    process_args = ['python', './main.py']
+def get_renderer():
+    global renderer
+    if renderer is None:
+        # Imported here, so planning (and --list) doesn't load panda
+        from helper.renderer import Renderer
 
-    if options.scale_to_fit:
-        process_args.append('-f')
+        renderer = Renderer(get_render_size(), options.rsp_paths, options.mc_base_rsp_path, options.tiles)
 
-    process_args += ['-s', str(main_script_output_size), options.rsp_path, options.mc_base_rsp_path, filename,
-                     './temp/out.png']
+    return renderer
 
-    process_result = subprocess.call(process_args, stderr=subprocess.DEVNULL)
 
-    if process_result != 0:
+def init_worker():
+    '''
+    Sets up the panda context and asset index of a worker as it starts, so they don't count towards the render cost of
+    its first job (see RenderCosts).
+    '''
+    if options.profile is not None:
+        enable_profiling(options.profile_memory)
+    get_renderer()
+    get_asset_index(get_pack_stack(options.rsp_paths, options.mc_base_rsp_path))
+
+
+def render_image(model, texture_overrides=None, texture_atlas=None):
+    try:
+        # Plain item sprites don't need the 3D pipeline at all
+        with stage('render_sprite'):
+            image = render_sprite(model, get_render_size(), 'gui', options.rsp_paths, options.mc_base_rsp_path,
+                                  texture_overrides)
+        if image is not None:
+            return image
+
+        current_renderer = get_renderer()
+        # Texture override variants of the same model reuse the loaded geometry, and only swap textures; with a texture
+        # atlas, that remaps the uvs into the atlas (see RenderTile.set_atlas_textures)
+        if current_renderer.model is not model or current_renderer.texture_atlas is not texture_atlas:
+            current_renderer.load(model, 'gui', options.scale_to_fit, texture_overrides, texture_atlas)
+        return current_renderer.render_variant(texture_overrides)
+    except Exception as e:
+        print('Render failed: ' + str(e))
+        return None
+
+
+def render_animated(model, texture_overrides=None):
+    '''
+    Renders every frame of the animated textures of the model, loading the model at most once.
+    :return: List of [image, duration in ms] (see render_animation), or None if the render failed
+    '''
+    current_renderer = None
+
+    def render_frame(texture_frames):
+        nonlocal current_renderer
+        with stage('render_sprite'):
+            image = render_sprite(model, get_render_size(), 'gui', options.rsp_paths, options.mc_base_rsp_path,
+                                  texture_overrides, texture_frames)
+        if image is not None:
+            return image
+
+        if current_renderer is None:
+            current_renderer = get_renderer()
+            # The frames are stepped with texture matrices, which don't work with uvs remapped into a texture atlas
+            if current_renderer.model is not model or current_renderer.texture_atlas is not None:
+                current_renderer.load(model, 'gui', options.scale_to_fit, texture_overrides)
+            current_renderer.set_texture_overrides(texture_overrides)
+        return current_renderer.render_frame(texture_frames)
+
+    try:
+        return render_animation(model, get_animation_timeline(model), render_frame)
+    except Exception as e:
+        print('Render failed: ' + str(e))
+        return None
+    finally:
+        if current_renderer is not None and current_renderer.model is model:
+            current_renderer.set_texture_frames()
+
+
+def write_files(encoded, output_files):
+    with stage('write'):
+        for output_file in output_files:
+            os.makedirs(os.path.dirname(output_file), exist_ok=True)
+            with open(output_file, 'wb') as out:
+                out.write(encoded)
+
+
+def write_outputs(image, output_files):
+    '''
+    :return: The image, encoded as PNG
+    '''
+    if options.downscale:
+        with stage('downscale'):
+            image = downscale(image, options.output_size, options.downscale_filter)
+
+    # Encode once, then fan the same bytes out to every output
+    encoded = io.BytesIO()
+    with stage('encode'):
+        image.save(encoded, format='PNG')
+
+    if not options.atlas or options.atlas_keep_icons:
+        write_files(encoded.getvalue(), output_files)
+
+    return encoded.getvalue()
+
+
+def write_animation(frames, output_files):
+    '''
+    :param frames: List of [image, duration in ms] (see render_animation)
+    '''
+    if options.downscale:
+        with stage('downscale'):
+            frames = [[downscale(image, options.output_size, options.downscale_filter), duration]
+                      for image, duration in frames]
+
+    with stage('encode'):
+        encoded = encode_animation(frames, options.animated)
+    write_files(encoded, output_files)
+
+
+def output_exists(output_file):
+    if options.atlas:
+        return previous_atlas is not None and previous_atlas.has_icon(get_icon_name(output_file, options.output_folder))
+    return os.path.exists(output_file)
+
+
+def get_render_settings():
+    return {
+        'size': options.output_size,
+        'superscale_size': options.scale_size if options.downscale else None,
+        'downscale_filter': options.downscale_filter if options.downscale else None,
+        'view': 'gui',
+        'scale_to_fit': options.scale_to_fit,
+        'animated': options.animated,
+    }
+
+
+def load_model(resource_id):
+    model_path = get_path_from_model_id(resource_id, options.rsp_paths, options.mc_base_rsp_path, '.json')
+    model_id = get_model_id_from_file_path(model_path, options.rsp_paths[0],
+                                           options.rsp_paths[1:] + [options.mc_base_rsp_path])
+    with stage('load_model_json'):
+        model = load_model_json(model_id, options.rsp_paths, options.mc_base_rsp_path)
+    with stage('fill_frame_data'):
+        fill_frame_data(model, options.rsp_paths, options.mc_base_rsp_path)
+    return model
+
+
+def plan_icon(planner: RenderPlanner, resource_id, input_hashes, up_to_date):
+    '''
+    Adds every render the model needs to the planner. Outputs that the manifest shows are already up to date are left
+    out.
+    :param input_hashes: Map that output file -> input hash gets added to for every planned output, when incremental
+    :param up_to_date: List that every output file left out gets appended to
+    :return: False if the model failed to load
+    '''
+    filename = get_path_from_model_id(resource_id, options.rsp_paths, options.mc_base_rsp_path, '.json')
+    abs_file_name = os.path.abspath(filename)
+    print('Planning icon for file ' + abs_file_name)
+
+    try:
+        model = load_model(resource_id)
+    except Exception as e:
+        print('Failed to load model: ' + str(e))
         print('Failed to generate icon for file ' + abs_file_name)
-        return
+        return False
 
+    out_names = options.file_name_map.get(resource_id) if options.file_name_map is not None else None
     if out_names is None:
         out_names = [get_new_file_name(filename, '')]
 
-    basic_out_names = filter(lambda x: type(x) is str, out_names)
-    overriden_texture_names = filter(lambda x: type(x) is not str, out_names)
-
-    # Anything that has a texture override must be rendered on a separate pass;
-    # so we should do outnames with no texture overrides,
-    # then do each one with texture overrides
-    #
     # Here's the structure of an entry that has texture overrides...
     # {
     #     name: '',
@@ -77,67 +237,36 @@ def generate_icon(filename, out_names=None):
     #         key: val
     #     }
     # }
-
-    if options.downscale_ffmpeg:
-        subprocess.call(
-            ['ffmpeg', '-loglevel', 'fatal', '-nostats', '-i', 'temp/out.png', '-vf',
-             f'scale={options.output_size}:-1', '-pix_fmt', 'rgba', '-y',
-             'temp/out_scaled.png'])
-
-        file_to_copy = 'temp/out_scaled.png'
-    else:
-        file_to_copy = 'temp/out.png'
-
-    for name in basic_out_names:
-        output_file = os.path.join(options.output_folder, name) + '.png'
-        output_folder = os.path.dirname(output_file)
-        if not os.path.exists(output_folder):
-            os.makedirs(output_folder)
-
-        copyfile(file_to_copy, output_file)
-
-    for obj in overriden_texture_names:
-        output_file = os.path.join(options.output_folder, obj['name']) + '.png'
-        output_folder = os.path.dirname(output_file)
-        if not os.path.exists(output_folder):
-            os.makedirs(output_folder)
-
-        texture_override_args = process_args.copy()
-
-        for orig, override in obj['texture_overrides'].items():
-            texture_override_args += ['-to', f'{orig}={override}']
-
-        process_result = subprocess.call(texture_override_args, stderr=subprocess.DEVNULL)
-
-        if process_result != 0:
-            print('Failed to generate icon for file ' + abs_file_name)
-            return
-
-        if options.downscale_ffmpeg:
-            subprocess.call(
-                ['ffmpeg', '-loglevel', 'fatal', '-nostats', '-i', 'temp/out.png', '-vf',
-                 f'scale={options.output_size}:-1', '-pix_fmt', 'rgba', '-y',
-                 'temp/out_scaled.png'])
-
-            file_to_copy = 'temp/out_scaled.png'
-        else:
-            file_to_copy = 'temp/out.png'
-
-        copyfile(file_to_copy, output_file)
-
+    renders = [(None, [os.path.join(options.output_folder, name) + '.png'
+                       for name in out_names if type(name) is str])]
+    renders += [(obj['texture_overrides'], [os.path.join(options.output_folder, obj['name']) + '.png'])
+                for obj in out_names if type(obj) is not str]
+    if options.animated is not None and is_animated(model):
+        renders = [(texture_overrides, [get_animation_file(output_file, options.animated)
+                                        for output_file in output_files])
+                   for texture_overrides, output_files in renders]
+
+    for texture_overrides, output_files in renders:
+        if manifest is not None and len(output_files) > 0:
+            input_hash = get_input_hash(model, options.rsp_paths, options.mc_base_rsp_path, get_render_settings(),
+                                        texture_overrides)
+            if all(manifest.is_up_to_date(output_file, input_hash, output_exists) for output_file in output_files):
+                print('Up to date: ' + ', '.join(output_files))
+                up_to_date.extend(output_files)
+                continue
+            input_hashes.update((output_file, input_hash) for output_file in output_files)
+
+        planner.add(resource_id, model, texture_overrides, output_files)
+
+    return True
 
 
 def get_all_ids_from_pack(pack_path):
-    # TODO: Discover namespaces other than minecraft
-    models_dir = os.path.join(options.rsp_path, 'assets', 'minecraft', 'models')
+    index = get_asset_index(get_pack_stack(options.rsp_paths, options.mc_base_rsp_path))
 
     ids = []
-    if os.path.exists(models_dir):
-        for tup in os.walk(models_dir):
-            for filename in tup[2]:
-                if filename.endswith('.json'):
-                    full_path = os.path.abspath(os.path.join(tup[0], filename))
-                    ids.append(get_model_id_from_file_path(full_path, pack_path, []))
+    for namespace, path in index.list_pack_files(pack_path, 'models', '.json'):
+        ids.append(path if namespace == 'minecraft' else f'{namespace}:{path}')
 
     return ids
 
@@ -158,13 +287,265 @@ def get_models_to_render() -> Set:  # Returns a Set of resource identifiers to r
     return model_ids
 
 
+def render_tiled(renders):
+    '''
+    Renders up to tiles x tiles models with a single frame (see Renderer.render_tiles).
+    :param renders: List of tuple (model, texture overrides, texture atlas)
+    :return: List of the rendered image of every render, or None where it failed
+    '''
+    try:
+        return get_renderer().render_tiles([(model, 'gui', options.scale_to_fit, texture_overrides, texture_atlas)
+                                            for model, texture_overrides, texture_atlas in renders])
+    except Exception as e:
+        print('Render failed: ' + str(e))
+        return [None] * len(renders)
+
+
+def render_batches(batches):
+    '''
+    Renders a job of the workers (see render_job), as one stage of the profile.
+    :return: The results of render_job, and the profiling events it recorded
+    '''
+    with stage('job', models=[batch.resource_id for batch in batches]):
+        results = render_job(batches)
+    record_memory()
+    return results + (pop_events(),)
+
+
+def render_job(batches):
+    '''
+    Renders every target of the batches, loading the geometry of each batch once. With --tiles, the targets that need
+    the 3D pipeline are collected, and rendered a whole grid at a time.
+    :return: Tuple (list of resource ids of the failed targets, list of resource ids of the rendered targets, list of
+    output files rendered, list of (output files, PNG bytes) of every rendered icon when building an atlas, map of the
+    resource id of every batch to [seconds spent on it, number of targets])
+    '''
+    failed = []
+    rendered = []
+    written = []
+    icons = []
+    costs = {}
+    tiled = []  # List of (model, texture overrides, texture atlas, target, batch resource id) waiting for a frame
+
+    def add_image(target, image):
+        if image is None:
+            failed.extend(target.resource_ids)
+            return
+
+        encoded = write_outputs(image, target.output_files)
+        rendered.extend(target.resource_ids)
+        written.extend(target.output_files)
+        if options.atlas:
+            icons.append((target.output_files, encoded))
+
+    def flush_tiled():
+        '''
+        :return: Seconds spent; split evenly between the batches of the tiles
+        '''
+        start = time.perf_counter()
+        images = render_tiled([(model, texture_overrides, texture_atlas)
+                               for model, texture_overrides, texture_atlas, _, _ in tiled])
+        for (_, _, _, target, _), image in zip(tiled, images):
+            add_image(target, image)
+
+        elapsed = time.perf_counter() - start
+        for _, _, _, _, resource_id in tiled:
+            costs[resource_id][0] += elapsed / len(tiled)
+        tiled.clear()
+        return elapsed
+
+    # One texture atlas for as many batches of the job as fit, so the tiles of a grid mostly sample the same one
+    texture_atlases = [None] * len(batches)
+    if options.texture_atlas:
+        try:
+            texture_atlases = build_texture_atlases([batch.get_texture_files() for batch in batches])
+        except Exception as e:
+            print(f'Not using a texture atlas for {", ".join(batch.resource_id for batch in batches)}: {e}')
+        else:
+            for batch, texture_atlas in zip(batches, texture_atlases):
+                if texture_atlas is None:
+                    print(f'Not using a texture atlas for {batch.resource_id}: its textures don\'t fit in one')
+
+    for batch_index, batch in enumerate(batches):
+        batch_start = time.perf_counter()
+        flush_seconds = 0
+        costs[batch.resource_id] = [0, len(batch.targets)]
+        try:
+            model = load_model(batch.resource_id)
+        except Exception as e:
+            print(f'Failed to load model {batch.resource_id}: {e}')
+            failed.extend(batch.get_resource_ids())
+            continue
+
+        texture_atlas = texture_atlases[batch_index]
+        for target in batch.targets.values():
+            print('Rendering ' + ', '.join(target.output_files))
+            texture_overrides = {name: texture_file for name, texture_file in target.texture_files.items()
+                                 if texture_file is not None}
+            if options.animated is not None and is_animated(model):
+                frames = render_animated(model, texture_overrides)
+                if frames is None:
+                    failed.extend(target.resource_ids)
+                else:
+                    write_animation(frames, target.output_files)
+                    rendered.extend(target.resource_ids)
+                    written.extend(target.output_files)
+                continue
+
+            if options.tiles <= 1:
+                add_image(target, render_image(model, texture_overrides, texture_atlas))
+                continue
+
+            try:
+                with stage('render_sprite'):
+                    image = render_sprite(model, get_render_size(), 'gui', options.rsp_paths,
+                                          options.mc_base_rsp_path, texture_overrides)
+            except Exception as e:
+                print('Render failed: ' + str(e))
+                failed.extend(target.resource_ids)
+                continue
+            if image is not None:
+                add_image(target, image)
+                continue
+
+            tiled.append((model, texture_overrides, texture_atlas, target, batch.resource_id))
+            if len(tiled) == options.tiles * options.tiles:
+                flush_seconds += flush_tiled()
+
+        costs[batch.resource_id][0] += time.perf_counter() - batch_start - flush_seconds
+
+    if len(tiled) > 0:
+        flush_tiled()
+
+    return failed, rendered, written, icons, costs
+
+
+def add_previous_icons(atlas: AtlasBuilder, output_files):
+    '''
+    Copies icons that are up to date over from the previous atlas, keeping icons that shared a rect together.
+    '''
+    files_by_rect = {}
+    for output_file in output_files:
+        name = get_icon_name(output_file, options.output_folder)
+        rect = previous_atlas.icons[name]
+        rect_key = (rect['sheet'], rect['x'], rect['y'], rect['width'], rect['height'])
+        files_by_rect.setdefault(rect_key, (name, []))[1].append(output_file)
+
+    # One sheet at a time, so each one is decoded once and only one is held in memory
+    sheet = None
+    for rect_key, (name, rect_files) in sorted(files_by_rect.items()):
+        if rect_key[0] != sheet:
+            previous_atlas.release_sheets()
+            sheet = rect_key[0]
+        atlas.add_image(rect_files, previous_atlas.get_icon(name))
+    previous_atlas.release_sheets()
+
+
 def main():
+    global manifest, previous_atlas
+    if options.profile is not None:
+        enable_profiling(options.profile_memory)
     models_to_render = get_models_to_render()
-    for resource_id in models_to_render:
-        out_file_names = options.file_name_map[
-            resource_id] if options.file_name_map is not None and resource_id in options.file_name_map else None
-        generate_icon(get_path_from_model_id(resource_id, options.rsp_path, options.mc_base_rsp_path, '.json'),
-                      out_file_names)
 
+    if options.incremental:
+        manifest_file = options.manifest_file
+        if manifest_file is None:
+            manifest_file = os.path.join(options.output_folder, '.render_manifest.json')
+        manifest = RenderManifest(manifest_file)
+        if options.atlas:
+            previous_atlas = AtlasIndex(options.output_folder, options.atlas_name)
+
+    atlas = None
+    if options.atlas:
+        atlas = AtlasBuilder(options.output_folder, options.atlas_name, options.atlas_size)
+
+    # Models that resolve to the same geometry and textures are only rendered once
+    planner = RenderPlanner(options.rsp_paths, options.mc_base_rsp_path, 'gui')
+    input_hashes = {}  # Map of output file to input hash; only filled with --incremental
+    up_to_date = []
+    failed = set()
+    rendered = set()
+    with stage('plan', models=len(models_to_render)):
+        for resource_id in sorted(models_to_render):
+            if not plan_icon(planner, resource_id, input_hashes, up_to_date):
+                failed.add(resource_id)
+
+    if options.list:
+        for batch in planner.get_batches():
+            for target in batch.targets.values():
+                print(', '.join(target.resource_ids) + ' -> ' + ', '.join(target.output_files))
+        print(f'Planned {planner.get_num_renders()} renders for {len(models_to_render)} models')
+        return
+
+    render_costs = None
+    if options.jobs > 1:
+        cost_file = options.cost_file
+        if cost_file is None:
+            cost_file = os.path.join(options.output_folder, '.render_costs.json')
+        render_costs = RenderCosts(cost_file)
+
+    # Jobs fill at least one frame of tiles; with workers, several, and the ones expected to take longest go first
+    jobs = schedule_jobs(planner.get_batches(), options.tiles * options.tiles, render_costs, options.jobs)
+    print(f'Planned {planner.get_num_renders()} renders for {len(models_to_render)} models')
 
-main()
+    pool = None
+    events = []  # Profiling events of every job, and of the main process
+    try:
+        if options.jobs > 1:
+            pool = multiprocessing.Pool(options.jobs, initializer=init_worker)
+            job_results = pool.imap_unordered(render_batches, jobs)
+        else:
+            job_results = map(render_batches, jobs)
+
+        atlas_written = []
+        for failed_ids, rendered_ids, written, icons, costs, job_events in job_results:
+            failed.update(failed_ids)
+            rendered.update(rendered_ids)
+            events += job_events
+            if render_costs is not None:
+                for resource_id, (seconds, num_targets) in costs.items():
+                    render_costs.record(resource_id, seconds, num_targets)
+            if atlas is not None:
+                for output_files, encoded in icons:
+                    atlas.add(output_files, encoded)
+                # Only up to date once the atlas is written
+                atlas_written += written
+            elif manifest is not None:
+                for output_file in written:
+                    manifest.record(output_file, input_hashes[output_file])
+
+        if atlas is not None:
+            if previous_atlas is not None:
+                add_previous_icons(atlas, up_to_date)
+            with stage('save_atlas'):
+                atlas.save()
+            if manifest is not None:
+                for output_file in atlas_written:
+                    manifest.record(output_file, input_hashes[output_file])
+    finally:
+        if pool is not None:
+            pool.terminate()
+        # Save even when interrupted, so the outputs rendered so far don't have to be rendered again
+        if manifest is not None:
+            manifest.save()
+        if render_costs is not None:
+            render_costs.save()
+        if options.profile is not None:
+            record_memory()
+            events += pop_events()
+            save_trace(options.profile, events, {'jobs': options.jobs, 'tiles': options.tiles,
+                                                 'main_max_rss_kb': get_max_rss_kb()})
+            print(format_stage_summary(get_stage_summary(events), get_max_rss_kb_of_events(events)))
+            print('Saved profile to ' + options.profile)
+
+    # Models with some renders failed count as failed; models with every output up to date as skipped
+    rendered -= failed
+    skipped = len(models_to_render) - len(rendered) - len(failed)
+    print(f'Rendered {len(rendered)} of {len(models_to_render)} models, skipped {skipped} up to date, '
+          f'{len(failed)} failed')
+    for resource_id in sorted(failed):
+        print('Failed: ' + resource_id)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,20 +1,76 @@
-import PIL
+import json
+import multiprocessing
+import os
 
+from helper.animation import ANIMATION_FORMAT_GIF, encode_animation, load_texture_animation
+from helper.assets import get_asset_index
 from helper.options import parse_create_animated_gif_options
-from PIL import Image
 
-options = parse_create_animated_gif_options()
 
-with Image.open(options.texture) as full_texture:
-    full_texture = full_texture.convert("RGBA")
-    texture_size = full_texture.width
-    if texture_size >= full_texture.height:
-        raise Exception("Textures width should be smaller than it's height!")
+def export_animation(job):
+    '''
+    :param job: Tuple (texture file, its .png.mcmeta or None, output file)
+    :return: False if the export failed
+    '''
+    texture_path, mcmeta_path, output_file = job
+    try:
+        encoded = encode_animation(load_texture_animation(texture_path, mcmeta_path), ANIMATION_FORMAT_GIF)
+    except Exception as e:
+        print(f'Failed to export {texture_path}: {e}')
+        return False
 
-    images = []
-    for i in range(0, full_texture.height // texture_size):
-        images.append(full_texture.crop((0, i * texture_size, texture_size, (i + 1) * texture_size)))
+    os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+    with open(output_file, 'wb') as out:
+        out.write(encoded)
+    print('Exported ' + output_file)
+    return True
 
-    # TODO: Extract frame times/order from mcmeta file
-    images[0].save(options.output_path, save_all=True, append_images=images[1:], duration=1000 // 20, loop=0,
-                   transparency=0, disposal=2)
+
+def get_pack_jobs(pack_path, output_folder):
+    '''
+    :return: Export job (see export_animation) of every texture of the pack with an animation in its .png.mcmeta; the
+    GIFs mirror the texture tree, e.g. <output folder>/minecraft/block/lava_still.gif
+    '''
+    index = get_asset_index((pack_path,))
+
+    jobs = []
+    for namespace, path in index.list_pack_files(pack_path, 'textures', '.png.mcmeta'):
+        texture_path = index.find(namespace, 'textures', path + '.png')
+        mcmeta_path = index.find(namespace, 'textures', path + '.png.mcmeta')
+        if texture_path is None:
+            continue
+
+        # .png.mcmeta files can describe other things than animations (e.g. blur), and those are left as they are
+        try:
+            with open(mcmeta_path, 'r') as mcmeta_file:
+                if 'animation' not in json.load(mcmeta_file):
+                    continue
+        except ValueError as e:
+            print(f'Failed to read {mcmeta_path}: {e}')
+            continue
+
+        jobs.append((texture_path, mcmeta_path, os.path.join(output_folder, namespace, *path.split('/')) + '.gif'))
+
+    return jobs
+
+
+def main():
+    options = parse_create_animated_gif_options()
+
+    if options.texture is not None:
+        mcmeta_path = options.texture + '.mcmeta'
+        jobs = [(options.texture, mcmeta_path if os.path.exists(mcmeta_path) else None, options.output_path)]
+    else:
+        jobs = get_pack_jobs(options.pack_path, options.output_path)
+
+    if options.jobs > 1 and len(jobs) > 1:
+        with multiprocessing.Pool(options.jobs) as pool:
+            results = list(pool.imap_unordered(export_animation, jobs))
+    else:
+        results = list(map(export_animation, jobs))
+
+    print(f'Exported {sum(results)} of {len(jobs)} animated textures')
+
+
+if __name__ == '__main__':
+    main()
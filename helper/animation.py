@@ -0,0 +1,210 @@
+import io
+import json
+import math
+from bisect import bisect_right
+from itertools import accumulate
+
+import numpy
+from PIL import Image
+
+from helper.model import ModelJSON, get_animation_frames
+
+ANIMATION_FORMAT_APNG = 'apng'
+ANIMATION_FORMAT_GIF = 'gif'
+ANIMATION_FORMATS = [ANIMATION_FORMAT_APNG, ANIMATION_FORMAT_GIF]
+
+# Textures that loop at awkward lengths can take a very long time to all line up again; stop the timeline here
+MAX_ANIMATION_MS = 60 * 1000
+
+# GIFs only have on/off transparency; pixels less opaque than this become transparent
+GIF_ALPHA_THRESHOLD = 128
+GIF_TRANSPARENT_INDEX = 255
+
+
+def is_animated(model: ModelJSON):
+    return any(texture.get_num_frames() > 1 for texture in model.textures)
+
+
+def get_frame_at(frame_ends, time):
+    '''
+    :param frame_ends: List of the time every frame of one loop ends at
+    :return: Index of the frame showing at the given time
+    '''
+    return bisect_right(frame_ends, time % frame_ends[-1])
+
+
+def get_animation_timeline(model: ModelJSON, max_ms=MAX_ANIMATION_MS):
+    '''
+    Steps every animated texture of the model through its frames at the same time, for as long as it takes all of them
+    to loop at once (or max_ms).
+    :param model: Fully loaded model json (see fill_frame_data)
+    :return: List of tuple (map of texture name to animation frame index, duration in ms); steps that show the same
+    frames as the step before them are merged into it
+    '''
+    frame_ends = {}
+    for texture in model.textures:
+        if texture.get_num_frames() > 1:
+            frame_ends[texture.name] = list(accumulate(texture.get_frame_times()))
+
+    if len(frame_ends) == 0:
+        return [({}, 0)]
+
+    total = 1
+    for ends in frame_ends.values():
+        total = total * ends[-1] // math.gcd(total, ends[-1])
+    total = min(total, max_ms)
+
+    # Every time any texture changes frame
+    changes = {0, total}
+    for ends in frame_ends.values():
+        for loop_start in range(0, total, ends[-1]):
+            changes.update(loop_start + end for end in ends if loop_start + end < total)
+    changes = sorted(changes)
+
+    timeline = []
+    for start, end in zip(changes, changes[1:]):
+        texture_frames = {name: get_frame_at(ends, start) for name, ends in frame_ends.items()}
+        if len(timeline) > 0 and timeline[-1][0] == texture_frames:
+            timeline[-1] = (texture_frames, timeline[-1][1] + end - start)
+        else:
+            timeline.append((texture_frames, end - start))
+
+    return timeline
+
+
+def render_animation(model: ModelJSON, timeline, render_frame):
+    '''
+    Renders every step of the timeline. Every distinct combination of texture frames is only rendered once, and
+    consecutive steps that come out the same are merged.
+    :param timeline: See get_animation_timeline
+    :param render_frame: Function that renders the model with the given map of texture name to animation frame index
+    :return: List of [image, duration in ms]
+    '''
+    images = {}  # Map of the strip offsets of every texture to the image rendered with them
+    frames = []
+    for texture_frames, duration in timeline:
+        # Different animation frames can show the same part of the strip
+        key = tuple(sorted((name, model.get_texture_by_name(name).animation_frames[frame].v_offset)
+                           for name, frame in texture_frames.items()))
+        if key not in images:
+            images[key] = render_frame(texture_frames)
+        image = images[key]
+
+        if len(frames) > 0 and (frames[-1][0] is image or
+                                numpy.array_equal(numpy.asarray(frames[-1][0]), numpy.asarray(image))):
+            frames[-1][1] += duration
+        else:
+            frames.append([image, duration])
+
+    return frames
+
+
+def load_texture_animation(texture_path, mcmeta_path=None):
+    '''
+    Splits the strip of an animated texture into its frames, in the order and with the times its .png.mcmeta gives. The
+    strip is decoded once, and frames that show more than once share one image.
+    :param mcmeta_path: The texture's .png.mcmeta, or None to show every frame of the strip in order
+    :return: List of [image, duration in ms] (see render_animation)
+    '''
+    with Image.open(texture_path) as strip:
+        strip = strip.convert('RGBA')
+
+    frame_size = strip.width
+    if strip.height < frame_size:
+        raise Exception('Textures width should be smaller than it\'s height!')
+
+    animation = {}
+    if mcmeta_path is not None:
+        with open(mcmeta_path, 'r') as mcmeta_file:
+            animation = json.load(mcmeta_file).get('animation', {})
+    frame_time, strip_frames = get_animation_frames(animation, strip.height // frame_size)
+
+    images = {}  # Map of strip index to the frame's image
+    frames = []
+    for index, time in strip_frames:
+        if index not in images:
+            images[index] = strip.crop((0, index * frame_size, frame_size, (index + 1) * frame_size))
+        duration = (1000 // 20) * (time if time is not None else frame_time)
+
+        if len(frames) > 0 and frames[-1][0] is images[index]:
+            frames[-1][1] += duration
+        else:
+            frames.append([images[index], duration])
+
+    return frames
+
+
+def get_shared_palette(pixels):
+    '''
+    :param pixels: List of (height, width, 4) RGBA arrays of every frame
+    :return: (N, 3) array of at most 255 colors, covering the opaque pixels of every frame
+    '''
+    opaque = numpy.concatenate([frame[frame[:, :, 3] >= GIF_ALPHA_THRESHOLD][:, :3] for frame in pixels])
+    colors = numpy.unique(opaque, axis=0)
+    if len(colors) <= GIF_TRANSPARENT_INDEX:
+        return colors if len(colors) > 0 else numpy.zeros((1, 3), dtype=numpy.uint8)
+
+    # Too many colors; let median cut pick the palette from every opaque pixel, so common colors get more entries
+    palette_image = Image.fromarray(opaque[numpy.newaxis]).quantize(colors=GIF_TRANSPARENT_INDEX,
+                                                                     method=Image.MEDIANCUT)
+    used = numpy.unique(numpy.asarray(palette_image))
+    palette = numpy.array(palette_image.getpalette(), dtype=numpy.uint8)
+    return palette[:len(palette) // 3 * 3].reshape((-1, 3))[used]
+
+
+def quantize_frames(images):
+    '''
+    Converts the frames of an animation to palette images that all share one palette, so colors don't shift from one
+    frame to the next. The palette is computed once for the whole animation (see get_shared_palette); transparent pixels
+    get GIF_TRANSPARENT_INDEX.
+    :return: List of "P" mode images
+    '''
+    pixels = [numpy.asarray(image.convert('RGBA')) for image in images]
+    palette = get_shared_palette(pixels)
+    palette_data = numpy.zeros((256, 3), dtype=numpy.uint8)
+    palette_data[:len(palette)] = palette
+
+    quantized = []
+    for frame in pixels:
+        # Nearest palette color of every distinct color of the frame
+        colors, inverse = numpy.unique(frame[:, :, :3].reshape((-1, 3)), axis=0, return_inverse=True)
+        distances = ((colors[:, numpy.newaxis, :].astype(numpy.int32) - palette[numpy.newaxis, :, :]) ** 2).sum(axis=2)
+        indices = distances.argmin(axis=1).astype(numpy.uint8)[inverse.reshape(-1)].reshape(frame.shape[:2])
+        indices[frame[:, :, 3] < GIF_ALPHA_THRESHOLD] = GIF_TRANSPARENT_INDEX
+
+        image = Image.fromarray(indices, 'P')
+        image.putpalette(palette_data.tobytes())
+        quantized.append(image)
+
+    return quantized
+
+
+def encode_animation(frames, animation_format=ANIMATION_FORMAT_APNG):
+    '''
+    :param frames: List of [image, duration in ms] (see render_animation)
+    :param animation_format: One of ANIMATION_FORMATS
+    :return: The animation, encoded as APNG or GIF
+    '''
+    images = [image.convert('RGBA') for image, _ in frames]
+    durations = [duration for _, duration in frames]
+
+    encoded = io.BytesIO()
+    if animation_format == ANIMATION_FORMAT_GIF:
+        images = quantize_frames(images)
+        images[0].save(encoded, format='GIF', save_all=True, append_images=images[1:], duration=durations, loop=0,
+                       disposal=2, transparency=GIF_TRANSPARENT_INDEX, optimize=False)
+    else:
+        # Every frame replaces the whole image, instead of being blended over the last one
+        images[0].save(encoded, format='PNG', save_all=True, append_images=images[1:], duration=durations, loop=0,
+                       disposal=0, blend=0)
+
+    return encoded.getvalue()
+
+
+def get_animation_file(output_file, animation_format):
+    '''
+    :return: The output file, with the extension of the animation format; APNGs keep the .png extension
+    '''
+    if animation_format == ANIMATION_FORMAT_GIF:
+        return output_file[:-len('.png')] + '.gif' if output_file.endswith('.png') else output_file + '.gif'
+    return output_file
@@ -0,0 +1,79 @@
+import os
+
+
+class AssetIndex:
+    '''
+    In-memory index of every file under assets/<namespace>/<type>/ of an ordered stack of resource packs. Packs earlier
+    in the stack take priority over later ones, the same way Minecraft layers resource packs; the default minecraft
+    assets should come last.
+    '''
+
+    def __init__(self, pack_paths):
+        self.pack_paths = list(pack_paths)
+        # Map of (namespace, type, path relative to the type folder, including the extension) to the file path
+        self.files = {}
+        # Map of pack path to the set of keys into self.files that the pack contains
+        self.pack_files = {}
+
+        # Scan lowest priority first, so higher priority packs overwrite its entries
+        for pack_path in reversed(self.pack_paths):
+            self.pack_files[pack_path] = set()
+            assets_path = os.path.join(pack_path, 'assets')
+            if not os.path.isdir(assets_path):
+                continue
+
+            for namespace in os.listdir(assets_path):
+                namespace_path = os.path.join(assets_path, namespace)
+                if not os.path.isdir(namespace_path):
+                    continue
+
+                for type in os.listdir(namespace_path):
+                    type_path = os.path.join(namespace_path, type)
+                    for dir_path, _, file_names in os.walk(type_path):
+                        rel_dir = os.path.relpath(dir_path, type_path).replace(os.path.sep, '/')
+                        for file_name in file_names:
+                            rel_path = file_name if rel_dir == '.' else rel_dir + '/' + file_name
+                            key = (namespace, type, rel_path)
+                            self.files[key] = os.path.join(dir_path, file_name)
+                            self.pack_files[pack_path].add(key)
+
+    def find(self, namespace, type, path):
+        '''
+        :return: The path of the highest priority file for the given asset, or None if no pack has it
+        '''
+        return self.files.get((namespace, type, path))
+
+    def list_pack_files(self, pack_path, type, ext):
+        '''
+        :return: List of (namespace, path without extension) of every file of the given type in the given pack
+        '''
+        return sorted((namespace, path[:-len(ext)]) for namespace, file_type, path in self.pack_files[pack_path]
+                      if file_type == type and path.endswith(ext))
+
+
+asset_indexes = {}  # Map of tuple of pack paths to AssetIndex
+
+
+def get_pack_stack(rsp_base_path, mc_rsp_base_path):
+    '''
+    :param rsp_base_path: Base path of the resource pack, or a list of resource pack paths, highest priority first
+    :param mc_rsp_base_path: Base path of the default minecraft resource pack
+    :return: Tuple of every pack path, highest priority first
+    '''
+    if isinstance(rsp_base_path, (list, tuple)):
+        return tuple(rsp_base_path) + (mc_rsp_base_path,)
+    return rsp_base_path, mc_rsp_base_path
+
+
+def get_asset_index(pack_paths) -> AssetIndex:
+    '''
+    Gets the index for the given stack of packs. The packs are only scanned the first time a stack is asked for.
+    '''
+    pack_paths = tuple(pack_paths)
+    if pack_paths not in asset_indexes:
+        asset_indexes[pack_paths] = AssetIndex(pack_paths)
+    return asset_indexes[pack_paths]
+
+
+def clear_asset_indexes():
+    asset_indexes.clear()
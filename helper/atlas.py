@@ -0,0 +1,163 @@
+import io
+import json
+import os
+
+from PIL import Image
+
+ATLAS_INDEX_VERSION = 1
+DEFAULT_ATLAS_SIZE = 2048
+
+
+def get_icon_name(output_file, output_folder):
+    '''
+    :return: Name of the output file in the atlas index: its path relative to the output folder, without extension
+    '''
+    rel_path = os.path.relpath(os.path.abspath(output_file), os.path.abspath(output_folder))
+    return os.path.splitext(rel_path)[0].replace(os.path.sep, '/')
+
+
+def get_index_path(output_folder, atlas_name):
+    return os.path.join(output_folder, atlas_name + '.json')
+
+
+def pack_shelves(sizes, max_size):
+    '''
+    Packs rectangles into as few max_size x max_size sheets as it can, filling shelves (rows) left to right, tallest
+    rectangles first. Rectangles bigger than a sheet get a sheet of their own.
+    :param sizes: List of (width, height) of every rectangle
+    :return: List of (sheet index, x, y) of every rectangle, in the order of sizes
+    '''
+    order = sorted(range(len(sizes)), key=lambda i: (-sizes[i][1], -sizes[i][0], i))
+    placements = [None] * len(sizes)
+
+    sheet = -1
+    shelf_x = shelf_y = shelf_height = 0
+    for i in order:
+        width, height = sizes[i]
+        if sheet >= 0 and shelf_x + width > max_size:
+            # Next shelf
+            shelf_x = 0
+            shelf_y += shelf_height
+            shelf_height = 0
+        if sheet < 0 or shelf_y + height > max_size or shelf_x + width > max_size:
+            # Next sheet
+            sheet += 1
+            shelf_x = shelf_y = shelf_height = 0
+
+        placements[i] = (sheet, shelf_x, shelf_y)
+        shelf_x += width
+        shelf_height = max(shelf_height, height)
+
+    return placements
+
+
+class AtlasIndex:
+    '''
+    Index json of a written atlas: which sheet every icon is on, and where.
+    '''
+
+    def __init__(self, output_folder, atlas_name):
+        self.output_folder = output_folder
+        self.sheets = []  # Sheet file names, relative to the output folder
+        self.icons = {}  # Map of icon name (see get_icon_name) to {sheet, x, y, width, height}
+        self.sheet_images = {}  # Map of sheet file name to its decoded image, for get_icon; see release_sheets
+
+        index_path = get_index_path(output_folder, atlas_name)
+        if os.path.exists(index_path):
+            with open(index_path, 'r') as index_file:
+                index = json.load(index_file)
+            if index.get('version') == ATLAS_INDEX_VERSION:
+                self.sheets = index['sheets']
+                self.icons = index['icons']
+
+    def has_icon(self, name):
+        return name in self.icons and os.path.exists(os.path.join(self.output_folder, self.icons[name]['sheet']))
+
+    def get_sheet(self, sheet_name) -> Image.Image:
+        '''
+        :return: The decoded sheet; every sheet is only decoded once, however many icons are taken from it
+        '''
+        sheet = self.sheet_images.get(sheet_name)
+        if sheet is None:
+            with Image.open(os.path.join(self.output_folder, sheet_name)) as sheet_file:
+                sheet = sheet_file.copy()
+            self.sheet_images[sheet_name] = sheet
+        return sheet
+
+    def get_icon(self, name) -> Image.Image:
+        rect = self.icons[name]
+        sheet = self.get_sheet(rect['sheet'])
+        return sheet.crop((rect['x'], rect['y'], rect['x'] + rect['width'], rect['y'] + rect['height']))
+
+    def release_sheets(self):
+        self.sheet_images.clear()
+
+
+class AtlasBuilder:
+    '''
+    Collects rendered icons, then packs them into atlas sheets: one set of sheets per icon size, so every sheet is a
+    uniform grid. The index json maps every icon name to its sheet and rect; icons with identical pixels (see
+    RenderPlanner) share one rect.
+    '''
+
+    def __init__(self, output_folder, atlas_name, max_size=DEFAULT_ATLAS_SIZE):
+        self.output_folder = output_folder
+        self.atlas_name = atlas_name
+        self.max_size = max_size
+        self.icons = []  # List of tuple (list of icon names, Image)
+
+    def add(self, output_files, encoded_png):
+        '''
+        :param output_files: Output files the icon was rendered for
+        :param encoded_png: The icon, as PNG bytes
+        '''
+        self.add_image(output_files, Image.open(io.BytesIO(encoded_png)))
+
+    def add_image(self, output_files, image: Image.Image):
+        self.icons.append(([get_icon_name(output_file, self.output_folder) for output_file in output_files], image))
+
+    def save(self):
+        '''
+        Writes the sheets and the index json, replacing the previous atlas of the same name.
+        '''
+        previous_sheets = AtlasIndex(self.output_folder, self.atlas_name).sheets
+
+        icons_by_size = {}
+        for names, image in sorted(self.icons, key=lambda icon: icon[0]):
+            icons_by_size.setdefault(image.size, []).append((names, image))
+
+        sheets = []
+        index_icons = {}
+        for (width, height), icons in sorted(icons_by_size.items()):
+            placements = pack_shelves([image.size for _, image in icons], self.max_size)
+
+            num_sheets = max(sheet for sheet, _, _ in placements) + 1
+            sheet_sizes = [[0, 0] for _ in range(num_sheets)]
+            for (sheet, x, y), (_, image) in zip(placements, icons):
+                sheet_sizes[sheet][0] = max(sheet_sizes[sheet][0], x + image.width)
+                sheet_sizes[sheet][1] = max(sheet_sizes[sheet][1], y + image.height)
+
+            sheet_images = [Image.new('RGBA', tuple(size), (0, 0, 0, 0)) for size in sheet_sizes]
+            sheet_names = [f'{self.atlas_name}_{width}x{height}_{i}.png' for i in range(num_sheets)]
+            for (sheet, x, y), (names, image) in zip(placements, icons):
+                sheet_images[sheet].paste(image.convert('RGBA'), (x, y))
+                for name in names:
+                    index_icons[name] = {'sheet': sheet_names[sheet], 'x': x, 'y': y, 'width': image.width,
+                                         'height': image.height}
+
+            os.makedirs(self.output_folder, exist_ok=True)
+            for sheet_name, sheet_image in zip(sheet_names, sheet_images):
+                sheet_image.save(os.path.join(self.output_folder, sheet_name))
+            sheets += sheet_names
+
+        for sheet_name in previous_sheets:
+            if sheet_name not in sheets and os.path.exists(os.path.join(self.output_folder, sheet_name)):
+                os.remove(os.path.join(self.output_folder, sheet_name))
+
+        os.makedirs(self.output_folder, exist_ok=True)
+        index_path = get_index_path(self.output_folder, self.atlas_name)
+        temp_path = index_path + '.tmp'
+        with open(temp_path, 'w') as index_file:
+            json.dump({'version': ATLAS_INDEX_VERSION, 'sheets': sheets, 'icons': index_icons}, index_file, indent=1,
+                      sort_keys=True)
+        os.replace(temp_path, index_path)
@@ -0,0 +1,148 @@
+import os
+
+import numpy
+from panda3d.core import ColorAttrib, GeomNode, GeomTriangles, GeomVertexData, GeomVertexFormat, \
+    Geom, NodePath, RenderState, TextureAttrib, TransparencyAttrib
+
+from helper.model import ModelJSON, get_path_from_model_id
+from helper.profiling import stage
+from helper.textures import get_texture_cache
+from helper.vertices import get_minecraft_model
+
+
+class AtlasRange:
+    '''
+    Vertices of one texture within a Geom that samples a texture atlas.
+    '''
+    __slots__ = ('geom_index', 'texture_name', 'texture_path', 'start', 'u', 'v')
+
+    def __init__(self, geom_index, texture_name, texture_path, start, u, v):
+        self.geom_index = geom_index  # Geom the texture was built into; the Geoms split off it share its vertex data
+        self.texture_name = texture_name
+        self.texture_path = texture_path  # Absolute path of the texture the uvs were mapped into the atlas for
+        self.start = start  # First vertex of the texture in the Geom
+        self.u = u  # Uvs of every vertex into the texture itself, before mapping them into the atlas
+        self.v = v
+
+
+def get_quad_indices(first):
+    '''
+    Each quad is stored as four vertices, shared by the two triangles that make up the quad.
+    :param first: Array of the first vertex of every quad
+    :return: Array of the six vertex indices of the triangles of every quad
+    '''
+    return first[:, numpy.newaxis] + numpy.array([2, 1, 0, 1, 2, 3], dtype=numpy.uint32)
+
+
+def build_model_node(base_path, base_mc_path, model_json: ModelJSON, texture_overrides, texture_atlas=None):
+    '''
+    Builds panda geometry for the given model json. Every texture gets its own Geom (two, if only some of its faces are
+    tinted); each quad is stored as four indexed vertices, shared by the two triangles that make up the quad.
+    :param base_path: Base path of the resource pack
+    :param base_mc_path: Base path of the default minecraft resource pack
+    :param model_json: Fully loaded model json (see load_model_json and fill_frame_data)
+    :param texture_overrides: Map of texture name to texture file path to use instead of the models texture
+    :param texture_atlas: TextureAtlas to take the textures from, instead of binding every texture separately. Uvs get
+    remapped into the atlas, and every texture with the same tint shares one Geom; textures missing from the atlas, or
+    sampled outside of their 0-1 uv range, still get Geoms of their own.
+    :return: Tuple (NodePath of the built geometry, list of the texture name of every Geom in Geom order, None for the
+    Geoms that sample the atlas, list of the AtlasRange of every texture taken from the atlas, list of tuple (Geom
+    index, AtlasRange or None) of every texture in the order its own Geom would have had without the atlas)
+    '''
+    with stage('generate_vertices'):
+        model = get_minecraft_model(base_path, model_json, None)
+
+    geom_node = GeomNode('model')
+    vertex_format = GeomVertexFormat.getV3n3t2()
+
+    # Normals of every quad, from the same two edges the old per quad code used
+    positions = model.positions
+    normals = numpy.cross(positions[:, 2] - positions[:, 1], positions[:, 2] - positions[:, 0])
+    lengths = numpy.linalg.norm(normals, axis=1, keepdims=True)
+    normals = numpy.divide(normals, lengths, out=numpy.zeros_like(normals), where=lengths > 0)
+
+    quads_by_texture = {}
+    for i, (texture, tinted) in enumerate(zip(model.quad_textures, model.quad_tinted)):
+        quads_by_texture.setdefault((texture[1:], bool(tinted)), []).append(i)
+
+    # Map of Geom key to [list of vertex rows, texture, tint or None, texture name or None, list of tuple (texture name,
+    # texture path, u, v) of the textures taken from the atlas], in Geom order
+    geoms = {}
+    texture_keys = []  # List of tuple (Geom key, index in the atlas textures of the Geom or None) of every texture
+    for (texture_name, tinted), quad_indices in quads_by_texture.items():
+        model_texture = model_json.get_texture_by_name(texture_name)
+
+        # Use texture overrides instead if we have any
+        if texture_name in texture_overrides:
+            texture_path = os.path.abspath(texture_overrides[texture_name])
+        else:
+            texture_path = get_path_from_model_id(model.textures[texture_name][0], base_path, base_mc_path, '.png',
+                                                  type='textures')
+
+        quad_positions = positions[quad_indices]
+        quad_normals = numpy.repeat(normals[quad_indices][:, numpy.newaxis, :], 4, axis=1)
+        quad_uvs = model.uvs[quad_indices]
+
+        # Interleaved rows of vertex, normal and texcoord; Minecraft models are Y-up, panda is Z-up
+        rows = numpy.empty((len(quad_indices), 4, 8), dtype=numpy.float32)
+        rows[:, :, 0] = quad_positions[:, :, 0]
+        rows[:, :, 1] = -quad_positions[:, :, 2]
+        rows[:, :, 2] = quad_positions[:, :, 1]
+        rows[:, :, 3] = quad_normals[:, :, 0]
+        rows[:, :, 4] = -quad_normals[:, :, 2]
+        rows[:, :, 5] = quad_normals[:, :, 1]
+        u = quad_uvs[:, :, 0]
+        v = model_texture.get_transformed_v_coord(quad_uvs[:, :, 1], 0)
+
+        tint = tuple(model.textures[texture_name][1]) if tinted else None
+        if texture_atlas is not None and texture_atlas.has_texture(texture_path) and \
+                numpy.all((u >= 0) & (u <= 1) & (v >= 0) & (v <= 1)):
+            rows[:, :, 6], rows[:, :, 7] = texture_atlas.remap_uvs(texture_path, u, v)
+            geom = geoms.setdefault(('atlas', tint), [[], texture_atlas.texture, tint, None, []])
+            texture_keys.append((('atlas', tint), len(geom[4])))
+            geom[4].append((texture_name, texture_path, u.reshape(-1), v.reshape(-1)))
+        else:
+            rows[:, :, 6] = u
+            rows[:, :, 7] = v
+            geom = geoms.setdefault((texture_name, tinted), [[], get_texture_cache().get(texture_path), tint,
+                                                             texture_name, []])
+            texture_keys.append(((texture_name, tinted), None))
+        geom[0].append(rows.reshape((-1, 8)))
+
+    geom_texture_names = []
+    atlas_ranges = []
+    geom_atlas_ranges = {}  # Map of Geom key to list of the AtlasRange of its atlas textures
+    for key, (geom_rows, texture, tint, texture_name, atlas_textures) in geoms.items():
+        start = 0
+        geom_atlas_ranges[key] = []
+        for (atlas_texture_name, texture_path, u, v), rows in zip(atlas_textures, geom_rows):
+            geom_atlas_ranges[key].append(AtlasRange(len(geom_texture_names), atlas_texture_name, texture_path, start,
+                                                     u, v))
+            start += len(rows)
+        atlas_ranges += geom_atlas_ranges[key]
+        rows = numpy.concatenate(geom_rows) if len(geom_rows) > 1 else geom_rows[0]
+
+        vertex_data = GeomVertexData(texture_name or 'atlas', vertex_format, Geom.UHStatic)
+        vertex_data.modifyArrayHandle(0).copyDataFrom(rows)
+
+        triangles = GeomTriangles(Geom.UHStatic)
+        triangles.setIndexType(Geom.NT_uint32)
+        triangles.modifyVertices().modifyHandle().copyDataFrom(
+            get_quad_indices(numpy.arange(0, len(rows), 4, dtype=numpy.uint32)))
+
+        geom = Geom(vertex_data)
+        geom.addPrimitive(triangles)
+
+        state = RenderState.make(TextureAttrib.make(texture),
+                                 TransparencyAttrib.make(TransparencyAttrib.M_alpha))
+        if tint is not None:
+            state = state.addAttrib(ColorAttrib.makeFlat((tint[0] / 255, tint[1] / 255, tint[2] / 255, 1)))
+
+        geom_node.addGeom(geom, state)
+        geom_texture_names.append(texture_name)
+
+    geom_indices = {key: i for i, key in enumerate(geoms)}
+    texture_order = [(geom_indices[key], geom_atlas_ranges[key][index] if index is not None else None)
+                     for key, index in texture_keys]
+
+    return NodePath(geom_node), geom_texture_names, atlas_ranges, texture_order
@@ -0,0 +1,109 @@
+import functools
+
+import numpy
+from PIL import Image
+
+# Pillow's alpha composite works in fixed point, with this many fractional bits
+COMPOSITE_PRECISION_BITS = 7
+
+
+def color_tuple_from_hexcode(hexcode):
+    return int(hexcode[1:3], 16), int(hexcode[3:5], 16), int(hexcode[5:7], 16)
+
+
+@functools.lru_cache(maxsize=None)
+def load_image(path) -> numpy.ndarray:
+    '''
+    Decodes the image once per process; every tint of it shares the decoded pixels.
+    :return: (height, width, 4) RGBA uint8 array; read only
+    '''
+    with Image.open(path) as image:
+        pixels = numpy.asarray(image.convert('RGBA'))
+    pixels.flags.writeable = False
+    return pixels
+
+
+@functools.lru_cache(maxsize=None)
+def get_tint_table(color_tuple) -> numpy.ndarray:
+    '''
+    :return: (256, 3) table of every channel value, multiplied by the color: round((x / 255) * c), rounding halves to
+    even like python's round
+    '''
+    table = numpy.round((numpy.arange(256)[:, numpy.newaxis] / 255) * numpy.array(color_tuple)).astype(numpy.uint8)
+    table.flags.writeable = False
+    return table
+
+
+def tint(pixels, color_tuple):
+    '''
+    :param pixels: RGBA uint8 array
+    :return: Copy of the pixels with the color channels multiplied by the color; alpha is kept
+    '''
+    table = get_tint_table(tuple(color_tuple))
+    tinted = pixels.copy()
+    for channel in range(3):
+        tinted[:, :, channel] = table[pixels[:, :, channel], channel]
+    return tinted
+
+
+def div255(value):
+    return ((value >> 8) + value) >> 8
+
+
+def alpha_composite(dst, src):
+    '''
+    Composites src over dst, giving exactly the pixels Image.alpha_composite does.
+    :param dst: RGBA uint8 array
+    :param src: RGBA uint8 array, the same size as dst
+    :return: RGBA uint8 array
+    '''
+    dst = dst.astype(numpy.uint32)
+    src = src.astype(numpy.uint32)
+    src_alpha = src[:, :, 3]
+
+    blend = dst[:, :, 3] * (255 - src_alpha)
+    out_alpha_255 = src_alpha * 255 + blend
+    coef1 = src_alpha * (255 * 255 << COMPOSITE_PRECISION_BITS) // numpy.maximum(out_alpha_255, 1)
+    coef2 = (255 << COMPOSITE_PRECISION_BITS) - coef1
+
+    out = numpy.empty(dst.shape, dtype=numpy.uint32)
+    color = src[:, :, :3] * coef1[:, :, numpy.newaxis] + dst[:, :, :3] * coef2[:, :, numpy.newaxis]
+    out[:, :, :3] = div255(color + (0x80 << COMPOSITE_PRECISION_BITS)) >> COMPOSITE_PRECISION_BITS
+    out[:, :, 3] = div255(out_alpha_255 + 0x80)
+
+    # Fully transparent source pixels leave the destination as it is
+    transparent = src_alpha == 0
+    out[transparent] = dst[transparent]
+    return out.astype(numpy.uint8)
+
+
+def scale_icon(image: Image.Image, scale):
+    if scale is None:
+        return image
+    resample_method = Image.NEAREST if image.width <= scale else Image.BICUBIC
+    return image.resize((scale, scale), resample=resample_method)
+
+
+def generate_image(color_tuple, colormap_path, overlay_path, scale=None):
+    '''
+    Tints the colormap with the color, and composites the overlay over it.
+    :param colormap_path: Image to tint, or None
+    :param overlay_path: Image to composite over the tinted colormap, or None
+    :param scale: Size to scale the icon to, or None to keep its size
+    :return: The icon, or None if there is neither a colormap nor an overlay
+    '''
+    if colormap_path is None and overlay_path is None:
+        return None
+
+    if colormap_path is None:
+        return scale_icon(Image.fromarray(load_image(overlay_path)), scale)
+
+    tinted = tint(load_image(colormap_path), color_tuple)
+    if overlay_path is not None:
+        overlay = load_image(overlay_path)
+        if tinted.shape != overlay.shape:
+            tinted = numpy.asarray(Image.fromarray(tinted).resize((overlay.shape[1], overlay.shape[0]),
+                                                                  resample=Image.BICUBIC))
+        tinted = alpha_composite(tinted, overlay)
+
+    return scale_icon(Image.fromarray(tinted), scale)
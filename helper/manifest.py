@@ -0,0 +1,120 @@
+import hashlib
+import json
+import os
+
+from helper.model import ModelJSON, find_asset_path, get_path_from_model_id
+
+# Bump whenever a change to the renderer changes its output, so every icon gets re-rendered on the next run
+RENDER_MANIFEST_VERSION = 2
+
+file_hashes = {}  # Map of absolute file path to tuple (mtime, content hash)
+
+
+def hash_file(file_path):
+    '''
+    :return: The hex sha1 of the file contents, or None if the file doesn't exist
+    '''
+    file_path = os.path.abspath(file_path)
+    try:
+        mtime = os.stat(file_path).st_mtime_ns
+    except OSError:
+        return None
+
+    cached = file_hashes.get(file_path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    with open(file_path, 'rb') as input_file:
+        content_hash = hashlib.sha1(input_file.read()).hexdigest()
+
+    file_hashes[file_path] = (mtime, content_hash)
+    return content_hash
+
+
+def get_input_hash(model: ModelJSON, rsp_base_path, mc_rsp_base_path, render_settings, texture_overrides=None):
+    '''
+    Hashes everything a render of the given model depends on: every model json in its parent chain, every texture and
+    .png.mcmeta it references, the texture overrides, and the render settings.
+    :param model: Fully loaded model json (see load_model_json and fill_frame_data)
+    :param render_settings: json serializable description of the render settings (size, view, ...)
+    :param texture_overrides: Map of texture name to texture file path to use instead of the models texture
+    :return: Hex digest of the inputs
+    '''
+    if texture_overrides is None:
+        texture_overrides = {}
+
+    inputs = {
+        'version': RENDER_MANIFEST_VERSION,
+        'settings': render_settings,
+        'models': [],
+        'textures': [],
+    }
+
+    for json_id in model.full_id_path:
+        model_path = get_path_from_model_id(json_id, rsp_base_path, mc_rsp_base_path, '.json')
+        inputs['models'].append([json_id, hash_file(model_path)])
+
+    for texture in sorted(model.textures, key=lambda tex: tex.name):
+        if texture.name in texture_overrides:
+            texture_path = texture_overrides[texture.name]
+            mcmeta_path = None
+        elif texture.texture_ref.startswith('#'):
+            # Reference to a texture that the model never defines; there is no file behind it
+            texture_path = None
+            mcmeta_path = None
+        else:
+            texture_path = get_path_from_model_id(texture.texture_ref, rsp_base_path, mc_rsp_base_path, '.png',
+                                                  type='textures')
+            mcmeta_path = find_asset_path(texture.texture_ref, rsp_base_path, mc_rsp_base_path, '.png.mcmeta',
+                                          type='textures')
+
+        inputs['textures'].append([
+            texture.name,
+            texture.texture_ref,
+            texture_overrides.get(texture.name),
+            hash_file(texture_path) if texture_path is not None else None,
+            hash_file(mcmeta_path) if mcmeta_path is not None else None,
+        ])
+
+    return hashlib.sha1(json.dumps(inputs, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class RenderManifest:
+    '''
+    Records, for every rendered output file, the hash of the inputs it was rendered from (see get_input_hash), so
+    later runs can skip outputs whose inputs have not changed.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}  # Map of normalized output file path to input hash
+
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r') as manifest_file:
+                    entries = json.load(manifest_file)
+                if not isinstance(entries, dict):
+                    raise ValueError('not a map of output files')
+                self.entries = entries
+            except (ValueError, OSError):
+                # Every output is rendered again, and the manifest rewritten once they are
+                print('Ignoring unreadable render manifest ' + self.path)
+
+    def is_up_to_date(self, output_file, input_hash, exists=os.path.exists):
+        '''
+        :param exists: Checks whether the output is still there; by default, that the output file exists
+        '''
+        return self.entries.get(os.path.normpath(output_file)) == input_hash and exists(output_file)
+
+    def record(self, output_file, input_hash):
+        self.entries[os.path.normpath(output_file)] = input_hash
+
+    def save(self):
+        manifest_folder = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(manifest_folder, exist_ok=True)
+
+        # Write to a temporary file first, so an interrupted run can't leave a truncated manifest behind
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as manifest_file:
+            json.dump(self.entries, manifest_file, indent=1, sort_keys=True)
+        os.replace(temp_path, self.path)
@@ -1,108 +1,75 @@
 import json
 import math
 import os
+import sys
 from typing import List
 
+import numpy
 from PIL import Image
 
-SCALE_ROTATION_22_5 = 1 / math.cos(math.pi / 8)
-SCALE_ROTATION_GENERAL = 1 / math.cos(math.pi / 4)
-
-
-class Vertex:
-    def __init__(self, x, y, z, u, v, tex, tinted):
-        self.x = x
-        self.y = y
-        self.z = z
-
-        self.u = u
-        self.v = 16 - v
-        self.texture = tex
-        self.tinted = tinted
-
-    def rotate(self, origin, axis, angle, rescale):
-        (self.x, self.y, self.z) = self._rotate_single(self.x, self.y, self.z, origin, axis, angle)
-
-        if rescale:
-            scale = SCALE_ROTATION_22_5 if math.fabs(math.fabs(angle) - 22.5) < 0.01 else SCALE_ROTATION_GENERAL
-            if axis == "x":
-                self.y = ((self.y - origin[1]) * scale) + origin[1]
-                self.z = ((self.z - origin[2]) * scale) + origin[2]
-            elif axis == "y":
-                self.x = ((self.x - origin[0]) * scale) + origin[0]
-                self.z = ((self.z - origin[2]) * scale) + origin[2]
-            else:
-                self.x = ((self.x - origin[0]) * scale) + origin[0]
-                self.y = ((self.y - origin[1]) * scale) + origin[1]
-
-        return self
-
-    def _rotate_single(self, x, y, z, origin, axis, angle):
-        cos = math.cos(math.radians(angle))
-        sin = math.sin(math.radians(angle))
-
-        if axis == "x":
-            y_shifted = y - origin[1]
-            z_shifted = z - origin[2]
-            y = (y_shifted * cos) + (z_shifted * -sin) + origin[1]
-            z = (y_shifted * sin) + (z_shifted * cos) + origin[2]
-        elif axis == "y":
-            x_shifted = x - origin[0]
-            z_shifted = z - origin[2]
-            x = (x_shifted * cos) + (z_shifted * sin) + origin[0]
-            z = (x_shifted * -sin) + (z_shifted * cos) + origin[2]
-        else:
-            x_shifted = x - origin[0]
-            y_shifted = y - origin[1]
-            x = (x_shifted * cos) + (y_shifted * -sin) + origin[0]
-            y = (x_shifted * sin) + (y_shifted * cos) + origin[1]
-
-        return x, y, z
-
-    # In MC's json files, UV coords are between 0 and 16, here we scale them so they are between 0 and 1
-    def normalizeUV(self):
-        self.u /= 16
-        self.v /= 16
-
-    def normalizePos(self):
-        self.x -= 8
-        self.y -= 8
-        self.z -= 8
+from helper.assets import get_asset_index, get_pack_stack
 
 
+# The model classes use __slots__, since a whole pack's worth of resolved models is kept in memory at once (see
+# model_json_cache); strings that repeat across models (ids, texture names and references, face names) are interned.
 class MinecraftModel:
+    __slots__ = ('positions', 'uvs', 'quad_textures', 'quad_tinted', 'textures')
+
     def __init__(self):
-        self.vertices: List[Vertex] = []
+        self.positions = numpy.zeros((0, 4, 3))  # (N, 4, 3) corner positions of every quad
+        self.uvs = numpy.zeros((0, 4, 2))  # (N, 4, 2) corner uvs of every quad
+        self.quad_textures: List[str] = []  # Texture reference ('#name') of every quad
+        self.quad_tinted = numpy.zeros(0, dtype=bool)  # (N,) whether every quad is tinted
         self.textures = {}  # Map of name to tuple [file, tinted]
 
 
 class ModelJSONAnimationFrame:
-    def __init__(self, v_offset=0):
+    __slots__ = ('v_offset', 'time')
+
+    def __init__(self, v_offset=0, time=None):
         self.v_offset = v_offset
+        self.time = time  # How long the frame shows, in ms; None for the frametime of its texture
 
 
 class ModelJSONTexture:
+    __slots__ = ('name', 'texture_ref', 'tinted', 'frametime', 'v_scale', 'animation_frames')
+
     def __init__(self, name, texture_ref, tinted=False, animation_frames=None, frame_time=1):
         if animation_frames is None:
             animation_frames = [ModelJSONAnimationFrame()]
-        self.name: str = name
-        self.texture_ref: str = texture_ref
+        self.name: str = sys.intern(name)
+        self.texture_ref: str = sys.intern(texture_ref)
         self.tinted: bool = tinted
         self.frametime: int = (1000 // 20) * frame_time
         self.v_scale: float = 1  # v coord = anim_frame.v_offset + (orig_v_coord * v_scale)
         self.animation_frames: List[ModelJSONAnimationFrame] = animation_frames
 
+    def copy(self):
+        texture = ModelJSONTexture(self.name, self.texture_ref, self.tinted)
+        texture.frametime = self.frametime
+        texture.v_scale = self.v_scale
+        texture.animation_frames = list(self.animation_frames)
+        return texture
+
     def get_transformed_v_coord(self, orig_v_coord: float, frame: int):
         return self.animation_frames[frame].v_offset + orig_v_coord * self.v_scale
 
     def get_num_frames(self):
         return len(self.animation_frames)
 
+    def get_frame_times(self):
+        '''
+        :return: List of how long every animation frame shows, in ms
+        '''
+        return [frame.time if frame.time is not None else self.frametime for frame in self.animation_frames]
+
     def set_frame_time(self, num_frames):
         self.frametime = (1000 // 20) * num_frames
 
 
 class Predicate:
+    __slots__ = ('damage', 'model')
+
     def __init__(self, damage, model):
         self.damage = damage
         self.model = model
@@ -119,31 +86,38 @@ class Predicate:
 
 
 class ModelJSONPosition:
+    __slots__ = ('rotation', 'translation', 'scale')
+
     def __init__(self):
-        self.rotation = [0, 0, 0]
-        self.translation = [0, 0, 0]
-        self.scale = [1, 1, 1]
-        pass
+        self.rotation = (0, 0, 0)
+        self.translation = (0, 0, 0)
+        self.scale = (1, 1, 1)
 
 
 class ModelJSONElement:
+    __slots__ = ('voxel_from', 'voxel_to', 'rotation', 'shade', 'faces')
+
     def __init__(self):
-        self.voxel_from = []
-        self.voxel_to = []
+        self.voxel_from = ()
+        self.voxel_to = ()
         self.rotation = ModelJSONElementRotation()
         self.shade = True
         self.faces = {}
 
 
 class ModelJSONElementRotation:
+    __slots__ = ('origin', 'axis', 'angle', 'rescale')
+
     def __init__(self):
-        self.origin = [0, 0, 0]
+        self.origin = (0, 0, 0)
         self.axis = 'x'
         self.angle = 0
         self.rescale = False
 
 
 class ModelJSONElementFace:
+    __slots__ = ('name', 'uvs', 'texture', 'cullface', 'rotation', 'tint_index')
+
     def __init__(self):
         self.name = ''
         self.uvs = None
@@ -154,6 +128,8 @@ class ModelJSONElementFace:
 
 
 class ModelJSON:
+    __slots__ = ('full_id_path', 'gui_light', 'ambientocclusion', 'display', 'textures', 'elements', 'predicates')
+
     def __init__(self):
         self.full_id_path = []
         self.gui_light = 'side'
@@ -163,6 +139,21 @@ class ModelJSON:
         self.elements: List[ModelJSONElement] = []
         self.predicates: List[Predicate] = []
 
+    def copy(self):
+        '''
+        Copies the model, so it can be modified without affecting the original. Textures are copied as well, since they
+        are filled in by normalize_textures and fill_frame_data; elements and display positions are shared.
+        '''
+        model = ModelJSON()
+        model.full_id_path = list(self.full_id_path)
+        model.gui_light = self.gui_light
+        model.ambientocclusion = self.ambientocclusion
+        model.display = dict(self.display)
+        model.textures = [tex.copy() for tex in self.textures]
+        model.elements = list(self.elements)
+        model.predicates = list(self.predicates)
+        return model
+
     def get_texture_by_name(self, name):
         for tex in self.textures:
             if tex.name == name:
@@ -177,6 +168,10 @@ class ModelJSON:
         return False
 
 
+def is_generated_item(model: ModelJSON):
+    return 'item/generated' in model.full_id_path or 'minecraft:item/generated' in model.full_id_path
+
+
 def get_model_id_from_file_path(json_file_path, rsp_base_path, extra_rsp_paths):
     rel_path = os.path.relpath(os.path.abspath(json_file_path), os.path.abspath(rsp_base_path))
     parts = rel_path.split(os.path.sep)
@@ -208,40 +203,54 @@ def get_namespaced_json_id(json_id):
     return json_id
 
 
-def get_path_from_model_id(path_id: str, rsp_base_path, mc_rsp_base_path, ext, type='models'):
+def split_model_id(path_id: str):
+    '''
+    :return: tuple of (namespace, path) for the given id; ids without a namespace are in the minecraft namespace
+    '''
+    if ':' in path_id:
+        return path_id.split(':')[0], path_id.split(':')[1]
+    return 'minecraft', path_id
+
+
+def find_asset_path(path_id: str, rsp_base_path, mc_rsp_base_path, ext, type='models'):
+    '''
+    Looks up the file for the given id in the asset index of the pack stack (see helper/assets.py), without touching
+    the file system.
+    :param rsp_base_path: Base path of the resource pack, or a list of resource pack paths, highest priority first
+    :return: The path of the file, or None if no pack contains it
+    '''
     if len(path_id.split('/')) >= 2 and path_id.split('/')[0] == 'builtin':
         return os.path.join(
             os.path.dirname(os.path.abspath(__file__)), '..', 'extra',
             os.path.sep.join(path_id.split('/')[1:])) + ext
 
-    namespace = 'minecraft'
-    path = path_id
-    if ':' in path_id:
-        namespace = path_id.split(':')[0]
-        path = path_id.split(':')[1]
+    namespace, path = split_model_id(path_id)
+    return get_asset_index(get_pack_stack(rsp_base_path, mc_rsp_base_path)).find(namespace, type, path + ext)
 
-    rsp_path = os.path.join(rsp_base_path, 'assets', namespace, type, path) + ext
-    mc_rsp_path = os.path.join(mc_rsp_base_path, 'assets', namespace, type, path) + ext
 
-    if os.path.exists(rsp_path):
-        return rsp_path
+def get_path_from_model_id(path_id: str, rsp_base_path, mc_rsp_base_path, ext, type='models'):
+    found_path = find_asset_path(path_id, rsp_base_path, mc_rsp_base_path, ext, type)
+    if found_path is not None:
+        return found_path
 
-    return mc_rsp_path
+    # Missing assets resolve to where they would be in the default pack, so the error on opening them is meaningful
+    namespace, path = split_model_id(path_id)
+    return os.path.join(mc_rsp_base_path, 'assets', namespace, type, path) + ext
 
 
 def generate_uvs(element: ModelJSONElement, element_face: ModelJSONElementFace, face: str):
     if face == 'north':
-        element_face.uvs = [element.voxel_from[0], element.voxel_from[1], element.voxel_to[0], element.voxel_to[1]]
+        element_face.uvs = (element.voxel_from[0], element.voxel_from[1], element.voxel_to[0], element.voxel_to[1])
     elif face == 'east':
-        element_face.uvs = [element.voxel_from[1], element.voxel_from[2], element.voxel_to[1], element.voxel_to[2]]
+        element_face.uvs = (element.voxel_from[1], element.voxel_from[2], element.voxel_to[1], element.voxel_to[2])
     elif face == 'south':
-        element_face.uvs = [element.voxel_from[0], element.voxel_from[1], element.voxel_to[0], element.voxel_to[1]]
+        element_face.uvs = (element.voxel_from[0], element.voxel_from[1], element.voxel_to[0], element.voxel_to[1])
     elif face == 'west':
-        element_face.uvs = [element.voxel_from[1], element.voxel_from[2], element.voxel_to[1], element.voxel_to[2]]
+        element_face.uvs = (element.voxel_from[1], element.voxel_from[2], element.voxel_to[1], element.voxel_to[2])
     elif face == 'up':
-        element_face.uvs = [element.voxel_from[0], element.voxel_from[2], element.voxel_to[0], element.voxel_to[2]]
+        element_face.uvs = (element.voxel_from[0], element.voxel_from[2], element.voxel_to[0], element.voxel_to[2])
     elif face == 'down':
-        element_face.uvs = [element.voxel_from[0], element.voxel_from[2], element.voxel_to[0], element.voxel_to[2]]
+        element_face.uvs = (element.voxel_from[0], element.voxel_from[2], element.voxel_to[0], element.voxel_to[2])
 
 
 ENTITY_MAPPINGS = {
@@ -254,23 +263,105 @@ ENTITY_MAPPINGS = {
 }
 
 
+class CachedModelJSON:
+    def __init__(self, model: ModelJSON, dependencies, context_dependent):
+        self.model = model
+        self.dependencies = dependencies  # List of (file path, mtime) of every file the model was resolved from
+        self.context_dependent = context_dependent  # True if the result depends on the ids of the child models
+
+
+json_file_cache = {}  # Map of absolute file path to tuple (mtime, parsed json)
+model_json_cache = {}  # Map of tuple (json id, pack stack) to CachedModelJSON
+
+
+def clear_model_json_cache():
+    json_file_cache.clear()
+    model_json_cache.clear()
+
+
+def load_json_file(file_path):
+    '''
+    Loads a json file, reusing the parsed json from earlier calls if the file has not been modified since.
+    :return: tuple of the parsed json (shared; must not be modified) and the mtime of the file
+    '''
+    file_path = os.path.abspath(file_path)
+    mtime = os.stat(file_path).st_mtime_ns
+
+    cached = json_file_cache.get(file_path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1], mtime
+
+    with open(file_path, "r") as json_file:
+        parsed = json.load(json_file)
+
+    json_file_cache[file_path] = (mtime, parsed)
+    return parsed, mtime
+
+
+def is_up_to_date(dependencies):
+    for file_path, mtime in dependencies:
+        try:
+            if os.stat(file_path).st_mtime_ns != mtime:
+                return False
+        except OSError:
+            return False
+    return True
+
+
 def load_model_json(json_id, rsp_base_path, mc_rsp_base_path, json_ids=None) -> ModelJSON:
+    '''
+    Loads the model with the given id, resolving its parents. Resolved models are cached, so shared parents are only
+    parsed once; the returned model is a copy, and is safe to modify.
+    '''
     if json_ids is None:
         json_ids = []
 
+    return load_model_json_cached(json_id, rsp_base_path, mc_rsp_base_path, json_ids)[0]
+
+
+def load_model_json_cached(json_id, rsp_base_path, mc_rsp_base_path, json_ids):
+    # With no child ids, a context dependent model (see resolve_model_json) can still be cached; it just can't be
+    # handed out to a call that has child ids, and vice versa.
+    top_level = len(json_ids) == 0
+    cache_key = (json_id, get_pack_stack(rsp_base_path, mc_rsp_base_path))
+
+    cached = model_json_cache.get(cache_key)
+    if cached is not None and (top_level or not cached.context_dependent) and is_up_to_date(cached.dependencies):
+        return cached.model.copy(), cached.dependencies, cached.context_dependent
+
+    model_structure, dependencies, context_dependent = resolve_model_json(json_id, rsp_base_path, mc_rsp_base_path,
+                                                                          json_ids)
+    if top_level or not context_dependent:
+        model_json_cache[cache_key] = CachedModelJSON(model_structure.copy(), dependencies, context_dependent)
+
+    return model_structure, dependencies, context_dependent
+
+
+def resolve_model_json(json_id, rsp_base_path, mc_rsp_base_path, json_ids):
+    '''
+    :return: tuple of the resolved model, the (file path, mtime) pairs it was resolved from, and whether it depends
+    on json_ids; that is only the case for models resolved through builtin/entity.
+    '''
     file_path = get_path_from_model_id(json_id, rsp_base_path, mc_rsp_base_path, '.json')
-    with open(file_path, "r") as model_file:
-        model = json.load(model_file)
+    model, mtime = load_json_file(file_path)
+    dependencies = [(os.path.abspath(file_path), mtime)]
+    context_dependent = False
 
     if json_id == 'builtin/entity':
+        context_dependent = True
         for id in ENTITY_MAPPINGS.keys():
             if id in json_ids:
-                return load_model_json(ENTITY_MAPPINGS[id], rsp_base_path, mc_rsp_base_path, json_ids)
+                model_structure, entity_dependencies, _ = load_model_json_cached(ENTITY_MAPPINGS[id], rsp_base_path,
+                                                                                 mc_rsp_base_path, json_ids)
+                return model_structure, dependencies + entity_dependencies, True
 
     model_structure = ModelJSON()
     if 'parent' in model:
         json_ids.append(json_id)
-        model_structure = load_model_json(model['parent'], rsp_base_path, mc_rsp_base_path, json_ids)
+        model_structure, parent_dependencies, parent_context_dependent = load_model_json_cached(
+            model['parent'], rsp_base_path, mc_rsp_base_path, json_ids)
+        dependencies += parent_dependencies
+        context_dependent = context_dependent or parent_context_dependent
 
     if '_shulker_box' in json_id:
         model_structure.textures.append(
@@ -278,7 +369,7 @@ def load_model_json(json_id, rsp_base_path, mc_rsp_base_path, json_ids=None) ->
     elif 'shulker_box' in json_id:
         model_structure.textures.append(ModelJSONTexture('generated', 'entity/shulker/shulker'))
 
-    model_structure.full_id_path.append(json_id)
+    model_structure.full_id_path.append(sys.intern(json_id))
 
     if 'ambientocclusion' in model:
         model_structure.ambientocclusion = model['ambientocclusion']
@@ -287,12 +378,12 @@ def load_model_json(json_id, rsp_base_path, mc_rsp_base_path, json_ids=None) ->
         for position in model['display'].keys():
             json_position = ModelJSONPosition()
             if 'rotation' in model['display'][position]:
-                json_position.rotation = model['display'][position]['rotation']
+                json_position.rotation = tuple(model['display'][position]['rotation'])
             if 'translation' in model['display'][position]:
-                json_position.translation = model['display'][position]['translation']
+                json_position.translation = tuple(model['display'][position]['translation'])
             if 'scale' in model['display'][position]:
-                json_position.scale = model['display'][position]['scale']
-            model_structure.display[position] = json_position
+                json_position.scale = tuple(model['display'][position]['scale'])
+            model_structure.display[sys.intern(position)] = json_position
 
     if 'textures' in model:
         for key, val in model['textures'].items():
@@ -304,13 +395,13 @@ def load_model_json(json_id, rsp_base_path, mc_rsp_base_path, json_ids=None) ->
         for json_elem in model['elements']:
             element = ModelJSONElement()
 
-            element.voxel_from = json_elem['from']
-            element.voxel_to = json_elem['to']
+            element.voxel_from = tuple(json_elem['from'])
+            element.voxel_to = tuple(json_elem['to'])
 
             element.rotation = ModelJSONElementRotation()
             if 'rotation' in json_elem:
-                element.rotation.origin = json_elem['rotation']['origin']
-                element.rotation.axis = json_elem['rotation']['axis']
+                element.rotation.origin = tuple(json_elem['rotation']['origin'])
+                element.rotation.axis = sys.intern(json_elem['rotation']['axis'])
                 element.rotation.angle = json_elem['rotation']['angle']
                 if 'rescale' in json_elem['rotation']:
                     element.rotation.rescale = json_elem['rotation']['rescale']
@@ -320,17 +411,18 @@ def load_model_json(json_id, rsp_base_path, mc_rsp_base_path, json_ids=None) ->
 
             if 'faces' in json_elem:
                 for face in json_elem['faces'].keys():
+                    face = sys.intern(face)
                     element.faces[face] = ModelJSONElementFace()
 
                     if 'uv' in json_elem['faces'][face]:
-                        element.faces[face].uvs = json_elem['faces'][face]['uv']
+                        element.faces[face].uvs = tuple(json_elem['faces'][face]['uv'])
                     else:
                         generate_uvs(element, element.faces[face], face)
 
-                    element.faces[face].texture = json_elem['faces'][face]['texture']
+                    element.faces[face].texture = sys.intern(json_elem['faces'][face]['texture'])
 
                     if 'cullface' in json_elem['faces'][face]:
-                        element.faces[face].cullface = json_elem['faces'][face]['cullface']
+                        element.faces[face].cullface = sys.intern(json_elem['faces'][face]['cullface'])
                     else:
                         element.faces[face].cullface = face
 
@@ -343,7 +435,7 @@ def load_model_json(json_id, rsp_base_path, mc_rsp_base_path, json_ids=None) ->
             model_structure.elements.append(element)
 
     if 'gui_light' in model:
-        model_structure.gui_light = model['gui_light']
+        model_structure.gui_light = sys.intern(model['gui_light'])
 
     if 'overrides' in model:
         model_structure.predicates = []
@@ -356,7 +448,7 @@ def load_model_json(json_id, rsp_base_path, mc_rsp_base_path, json_ids=None) ->
     if json_id == 'item/zombie_head' or json_id == 'minecraft:item/zombie_head':
         model_structure.textures.append(ModelJSONTexture('head', 'entity/zombie/zombie'))
 
-    return model_structure
+    return model_structure, dependencies, context_dependent
 
 
 def normalize_textures(mc_model: ModelJSON):
@@ -379,6 +471,24 @@ def normalize_textures(mc_model: ModelJSON):
                 break
 
 
+def get_animation_frames(animation, num_strip_frames):
+    '''
+    :param animation: The "animation" object of a .png.mcmeta file
+    :param num_strip_frames: Number of frames in the texture's strip
+    :return: Tuple (frame time in ticks, list of tuple (strip index, time in ticks or None for the frame time) of every
+    frame, in the order they show)
+    '''
+    frames = []
+    # Frames are either an index into the strip, or {"index": ..., "time": ...}
+    for frame in animation.get('frames', range(num_strip_frames)):
+        if type(frame) is dict:
+            frames.append((frame['index'], frame.get('time')))
+        else:
+            frames.append((frame, None))
+
+    return animation.get('frametime', 1), frames
+
+
 def fill_frame_data(mc_model: ModelJSON, rsp_base_path, mc_base_path):
     '''
     fills frame data for textures in given model
@@ -388,9 +498,9 @@ def fill_frame_data(mc_model: ModelJSON, rsp_base_path, mc_base_path):
     normalize_textures(mc_model)
 
     for tex in mc_model.textures:
-        animation_desc_path = get_path_from_model_id(tex.texture_ref, rsp_base_path, mc_base_path, '.png.mcmeta',
-                                                     type='textures')
-        if os.path.exists(animation_desc_path):
+        animation_desc_path = find_asset_path(tex.texture_ref, rsp_base_path, mc_base_path, '.png.mcmeta',
+                                              type='textures')
+        if animation_desc_path is not None:
             texture_path = get_path_from_model_id(tex.texture_ref, rsp_base_path, mc_base_path, '.png',
                                                   type='textures')
             with Image.open(texture_path) as png:
@@ -401,16 +511,11 @@ def fill_frame_data(mc_model: ModelJSON, rsp_base_path, mc_base_path):
                 animation_desc = json.load(animation_file_desc_file)
 
             if 'animation' in animation_desc.keys():
-                animation = animation_desc['animation']
-                frame_time = 1
-                frames = list(range(0, tex_height // tex_width))
-
-                if 'frametime' in animation:
-                    frame_time = animation['frametime']
-
-                if 'frames' in animation:
-                    frames = animation['frames']
+                frame_time, frames = get_animation_frames(animation_desc['animation'], tex_height // tex_width)
 
                 tex.set_frame_time(frame_time)
-                tex.v_scale = png.width / png.height
-                tex.animation_frames = [ModelJSONAnimationFrame(v_offset=(x * tex.v_scale)) for x in frames]
+                tex.v_scale = tex_width / tex_height
+                # Frame 0 is at the top of the strip, and v points up
+                tex.animation_frames = [ModelJSONAnimationFrame(v_offset=1 - (index + 1) * tex.v_scale,
+                                                                time=(1000 // 20) * time if time is not None else None)
+                                        for index, time in frames]
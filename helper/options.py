@@ -1,15 +1,26 @@
 import argparse
 import sys
 
+from helper.animation import ANIMATION_FORMATS
+from helper.atlas import DEFAULT_ATLAS_SIZE
+from helper.leather import color_tuple_from_hexcode
+from helper.scaling import DOWNSCALE_FILTER_BOX, DOWNSCALE_FILTERS
+from helper.synthetic_pack import PACK_SHAPES
+
+DEFAULT_JOBS = 1  # Worker processes every tool uses unless -j says otherwise
+
 class RenderOptions:
     def __init__(self, ns: argparse.Namespace):
         self.size = ns.size[0]
         self.view = ns.view[0]
         self.rsp_path = ns.rsp_path[0]
+        self.rsp_paths = [self.rsp_path] + ns.extra_rsp_path  # Every pack to layer over the default pack, highest priority first
         self.scale_to_fit = ns.scale_to_fit
         self.mc_base_rsp_path = ns.mc_base_rsp_path[0]
         self.file_in = ns.file_in[0]
         self.file_out = ns.file_out[0]
+        self.animated = ns.animated  # Render every frame of animated textures into an APNG or GIF
+        self.tint = color_tuple_from_hexcode(ns.tint) if ns.tint is not None else None  # Tint of the tinted faces
         self.texture_overrides = {}
         for overrideString in ns.texture_override:
             split = overrideString.split('=')
@@ -26,7 +37,13 @@ def parse_args() -> RenderOptions:
                         help='Specifies the view transform to use when rendering the model')
     parser.add_argument('-f', '--scale_to_fit', default=False, action='store_true',
                         help='Scale the bounds of the render space to fit the whole rendered model, instead of assuming the geometry fits within the standard 16x16 area')
+    parser.add_argument('-a', '--animated', default=False, action='store_true',
+                        help='Render every frame of the animated textures of the model; writes a GIF if the output file ends in .gif, or an APNG otherwise')
+    parser.add_argument('-t', '--tint', default=None, metavar='#RRGGBB',
+                        help='Tint the faces with a tintindex with this color, instead of the default tint of the model')
     parser.add_argument('-to', '--texture_override', action='append', default=[], help='Specify a texture to override a texture in the model file. E.g. <texture_id>=<path_to_override_texture>')
+    parser.add_argument('-rp', '--extra_rsp_path', action='append', default=[],
+                        help='Base path of another resource pack, layered below the resource pack and above the "default" minecraft resource pack. Can be given several times; earlier packs take priority')
     parser.add_argument('rsp_path', nargs=1, help='Base path of the resource pack')
     parser.add_argument('mc_base_rsp_path', nargs=1, help='Base path of the "default" minecraft resource pack')
     parser.add_argument('file_in', nargs=1, help='Path of the input file to render')
@@ -44,13 +61,30 @@ class RenderAllOptions:
         self.file_name_map = ns.map_file  # A JSON file that specifies a map from an input file (json) to one or more output files
         self.only_render_in_map = ns.map_only  # if true, only render items in file_name_map. Only valid if a file_name_map is specified
         self.scale_to_fit = ns.scale_to_fit  # Scale models to fit, instead of using standard 16x16 render space
-        self.downscale_ffmpeg = ns.downscale_ffmpeg  # Use ffmpeg to use superscaling to introduce anti-aliasing in the final image
+        self.downscale = ns.downscale  # Render at the superscale size and downscale, to introduce anti-aliasing in the final image
+        self.downscale_filter = ns.downscale_filter  # Resampling filter used when downscaling
         self.output_size = ns.size  # final image output size
-        self.scale_size = ns.superscale_size  # Output size from the render -- only used if use_ffmpeg_scaling is true
+        self.scale_size = ns.superscale_size  # Output size from the render -- only used if downscale is true
         self.render_set = ns.render_set[0]  # render rsp OR render all (base pack + rsp)
         self.render_tile_entities = ns.render_tile_entities  # if true, render tile entities (see /extra)
         self.output_folder = ns.output_path
+        self.jobs = ns.jobs  # Number of worker processes to render with
+        self.texture_cache_mb = ns.texture_cache_mb  # Memory budget of the texture cache of each renderer
+        self.incremental = ns.incremental  # Only re-render outputs whose inputs changed since the last incremental run
+        self.manifest_file = ns.manifest_file  # Manifest of input hashes used by incremental runs
+        self.cost_file = ns.cost_file  # Render times of previous parallel runs, used to start the slowest jobs first
+        self.atlas = ns.atlas  # Pack the icons into atlas sheets with an index json, instead of one PNG per icon
+        self.atlas_keep_icons = ns.atlas_keep_icons  # Write the per icon PNGs as well as the atlas
+        self.atlas_size = ns.atlas_size  # Maximum width and height of an atlas sheet
+        self.atlas_name = ns.atlas_name  # File name prefix of the atlas sheets and index json
+        self.texture_atlas = ns.texture_atlas  # Bind the textures of every batch of renders from one texture atlas
+        self.tiles = ns.tiles  # Render tiles x tiles icons with every frame
+        self.animated = ns.animated  # Animation format to render models with animated textures to, or None for a still
+        self.list = ns.list  # Only plan the renders, and list them with their output files
+        self.profile = ns.profile  # Chrome trace file to record the time of every render stage to, or None
+        self.profile_memory = ns.profile_memory  # Also trace the peak Python heap memory of every stage while profiling
         self.rsp_path = ns.rsp_path
+        self.rsp_paths = [self.rsp_path] + ns.extra_rsp_path  # Every pack to layer over the default pack, highest priority first
         self.mc_base_rsp_path = ns.mc_base_rsp_path
 
 
@@ -61,23 +95,62 @@ def parse_render_all_options() -> RenderAllOptions:
     parser.add_argument('-mf', '--map_file', default=None, help='Map file for input file to output file')
     parser.add_argument('-mo', '--map_only', default=False, action='store_true',
                         help='Only render files specified in the map file')
-    parser.add_argument('-d', '--downscale_ffmpeg', default=False, action='store_true',
-                        help='Use ffmpeg to downscale from a superscaled image, creating an aliasing effect. Requires ffmpeg installed on the PATH')
+    parser.add_argument('-d', '--downscale', '--downscale_ffmpeg', dest='downscale', default=False,
+                        action='store_true',
+                        help='Downscale from a superscaled image, creating an anti-aliasing effect')
+    parser.add_argument('-df', '--downscale_filter', default=DOWNSCALE_FILTER_BOX, choices=list(DOWNSCALE_FILTERS.keys()),
+                        help='Resampling filter to use with --downscale')
     parser.add_argument('-si', '--size', default=128, type=int, help='Output size (assumed square)')
     parser.add_argument('-ss', '--superscale_size', default=512, type=int,
-                        help='Superscale size, used with --downscale_ffmpeg')
+                        help='Superscale size, used with --downscale')
     parser.add_argument('-rs', '--render_set', default=[RENDER_OPTION_RSP],
                         choices=[RENDER_OPTION_RSP, RENDER_OPTION_ALL],
                         help='Specify whether to render just the files included in the rsp, or to extend to the base pack files as well')
     parser.add_argument('-rt', '--render_tile_entities', default=False, action='store_true',
                         help='Include tile entities from /extra to be rendered')
     parser.add_argument('-o', '--output_path', default='./rendered_rsp', help='Output folder')
+    parser.add_argument('-j', '--jobs', default=DEFAULT_JOBS, type=int, metavar='N',
+                        help='Number of worker processes to render with; each worker gets its own renderer')
+    parser.add_argument('-tc', '--texture_cache_mb', default=256, type=int, metavar='MB',
+                        help='Memory budget of the texture cache of each worker, in megabytes')
+    parser.add_argument('-i', '--incremental', default=False, action='store_true',
+                        help='Only re-render outputs whose models, textures, texture overrides or render settings changed since the last incremental run')
+    parser.add_argument('-cf', '--cost_file', default=None,
+                        help='File that parallel runs (-j) record how long every model took to render in, so the next run can start the slowest ones first. Defaults to .render_costs.json in the output folder')
+    parser.add_argument('-mn', '--manifest_file', default=None,
+                        help='Manifest file used by --incremental. Defaults to .render_manifest.json in the output folder')
+    parser.add_argument('-a', '--atlas', default=False, action='store_true',
+                        help='Pack the icons into atlas sheets in the output folder, with an index json of where every icon is, instead of writing one PNG per icon')
+    parser.add_argument('-ak', '--atlas_keep_icons', default=False, action='store_true',
+                        help='With --atlas, write the per icon PNGs as well')
+    parser.add_argument('-as', '--atlas_size', default=DEFAULT_ATLAS_SIZE, type=int, metavar='PX',
+                        help='Maximum width and height of an atlas sheet')
+    parser.add_argument('-an', '--atlas_name', default='atlas',
+                        help='File name of the atlas index json (with .json) and prefix of the atlas sheets')
+    parser.add_argument('-ta', '--texture_atlas', default=False, action='store_true',
+                        help='Pack the textures of every batch of renders into one texture atlas while rendering, so their geometry shares a single texture state')
+    parser.add_argument('-tl', '--tiles', default=1, type=int, metavar='K',
+                        help='Render K x K icons with every frame, each into a render buffer of its own')
+    parser.add_argument('-am', '--animated', default=None, choices=ANIMATION_FORMATS,
+                        help='Render every frame of models with animated textures, into an APNG (with a .png extension) or a GIF')
     parser.add_argument('-f', '--scale_to_fit', default=False, action='store_true',
                         help='Scale the bounds of the render space to fit the whole rendered model, instead of assuming the geometry fits within the standard 16x16 area')
+    parser.add_argument('-ls', '--list', default=False, action='store_true',
+                        help='Dry run: plan the renders and list every one with its output files, without rendering anything or loading panda')
+    parser.add_argument('-pf', '--profile', default=None, metavar='TRACE_FILE',
+                        help='Record the wall time of every render stage of every job, and the peak resident memory of every process, into a Chrome trace json (chrome://tracing or https://ui.perfetto.dev), and print a summary per stage')
+    parser.add_argument('-pm', '--profile_memory', default=False, action='store_true',
+                        help='With --profile, also trace the peak Python heap memory of every stage with tracemalloc. This slows down Python code, so the times get less accurate')
+    parser.add_argument('-rp', '--extra_rsp_path', action='append', default=[],
+                        help='Base path of another resource pack, layered below the resource pack and above the "default" minecraft resource pack. Can be given several times; earlier packs take priority')
     parser.add_argument('rsp_path', help='Base path of the resource pack')
     parser.add_argument('mc_base_rsp_path', help='Base path of the "default" minecraft resource pack')
 
-    return RenderAllOptions(parser.parse_args(sys.argv[1:]))
+    ns = parser.parse_args(sys.argv[1:])
+    if ns.animated is not None and ns.atlas:
+        parser.error('--animated can\'t be combined with --atlas')
+
+    return RenderAllOptions(ns)
 
 
 class RenderLeatherArmorsOptions:
@@ -86,12 +159,21 @@ class RenderLeatherArmorsOptions:
         self.output_path = ns.output_path
         self.rsp_path = ns.rsp_path
         self.description_file = ns.description_file
+        self.jobs = ns.jobs  # Number of worker processes to tint with
+        self.render = ns.render  # Render the icons through the 3D renderer, instead of tinting them in 2D
+        self.superscale_size = ns.superscale_size  # Size to render at with --render, before downscaling to scale
 
 
 def parse_render_leather_armors_options() -> RenderLeatherArmorsOptions:
     parser = argparse.ArgumentParser(description='Render tinted leather armors based on a description file.')
     parser.add_argument('-s', '--scale', type=int, default=None, help='Scale the icon to the provided size')
     parser.add_argument('-o', '--output_path', default='./rendered_rsp', help='Output folder')
+    parser.add_argument('-j', '--jobs', default=DEFAULT_JOBS, type=int, metavar='N',
+                        help='Number of worker processes to tint with')
+    parser.add_argument('-r', '--render', default=False, action='store_true',
+                        help='Render the icons through the 3D renderer, with its lighting; each armor piece is loaded once, and only its tint changes between colors. Renders at --scale, or 128 by default')
+    parser.add_argument('-ss', '--superscale_size', default=None, type=int,
+                        help='With --render, render at this size, then downscale to --scale')
     parser.add_argument('rsp_path', help='Base path of the resource pack')
     parser.add_argument('description_file', help='JSON file describing the leather armor icons to render')
 
@@ -100,12 +182,80 @@ def parse_render_leather_armors_options() -> RenderLeatherArmorsOptions:
 
 class CreateAnimatedGifOptions:
     def __init__(self, ns: argparse.Namespace):
-        self.texture = ns.texture
-        self.output_path = ns.output_path
+        self.texture = ns.texture  # Single texture to export, if not exporting a whole pack
+        self.pack_path = ns.pack_path  # Resource pack to export every animated texture of
+        self.output_path = ns.output_path  # Output file of a single texture, or output folder of a pack
+        if self.output_path is None:
+            self.output_path = './temp/out.gif' if self.texture is not None else './animated_textures'
+        self.jobs = ns.jobs  # Number of worker processes to export a pack with
 
 
 def parse_create_animated_gif_options() -> CreateAnimatedGifOptions:
     parser = argparse.ArgumentParser(description='Render an animated texture as a GIF.')
-    parser.add_argument('-o', '--output_path', default='./temp/out.gif', help='Output file')
-    parser.add_argument('texture', help='Texture file to turn into a GIF')
-    return CreateAnimatedGifOptions(parser.parse_args(sys.argv[1:]))
+    parser.add_argument('-o', '--output_path', default=None,
+                        help='Output file, or output folder with --pack_path. Defaults to ./temp/out.gif, or ./animated_textures with --pack_path')
+    parser.add_argument('-p', '--pack_path', default=None,
+                        help='Export every animated texture (every texture with a .png.mcmeta) of this resource pack, instead of a single texture')
+    parser.add_argument('-j', '--jobs', default=DEFAULT_JOBS, type=int, metavar='N',
+                        help='Number of worker processes to export a pack with')
+    parser.add_argument('texture', nargs='?', default=None, help='Texture file to turn into a GIF')
+
+    ns = parser.parse_args(sys.argv[1:])
+    if (ns.texture is None) == (ns.pack_path is None):
+        parser.error('Give either a texture or --pack_path')
+
+    return CreateAnimatedGifOptions(ns)
+
+
+class BenchmarkOptions:
+    def __init__(self, ns: argparse.Namespace):
+        self.shapes = ns.shapes  # Shapes of the synthetic packs to benchmark (see generate_pack)
+        self.models = ns.models  # Number of models of every synthetic pack
+        self.parent_depth = ns.parent_depth
+        self.elements = ns.elements
+        self.frames = ns.frames
+        self.overrides = ns.overrides
+        self.texture_size = ns.texture_size
+        self.repeat = ns.repeat  # Number of timed runs of every pack; the fastest one is reported
+        self.stages = ns.stages  # Do one more, profiled run of every pack for the time of every stage
+        self.check = ns.check  # Compare the icons with the ones rendered with one tile and no texture atlas
+        self.jobs = ns.jobs  # Worker processes of the renders (see convert_rsp)
+        self.tiles = ns.tiles
+        self.size = ns.size
+        self.texture_atlas = ns.texture_atlas
+        self.work_path = ns.work_path  # Folder to generate the packs and render into, or None for a temporary folder
+        self.output_file = ns.output_file  # JSON file to write the results to, or None to print them
+        self.baseline_file = ns.baseline_file  # Results of an earlier benchmark to compare with
+
+
+def parse_benchmark_options() -> BenchmarkOptions:
+    parser = argparse.ArgumentParser(description='Measure the render throughput of convert_rsp.py on synthetic resource packs.')
+    parser.add_argument('-s', '--shapes', nargs='+', default=PACK_SHAPES, choices=PACK_SHAPES,
+                        help='Shapes of pack to benchmark, each with a pack of its own')
+    parser.add_argument('-n', '--models', default=100, type=int, help='Number of models of every pack')
+    parser.add_argument('-pd', '--parent_depth', default=8, type=int,
+                        help='Number of parents of every model of the parents pack')
+    parser.add_argument('-el', '--elements', default=32, type=int,
+                        help='Number of rotated elements of every model of the elements and textures packs')
+    parser.add_argument('-fr', '--frames', default=8, type=int,
+                        help='Number of frames of every texture of the animated pack')
+    parser.add_argument('-ov', '--overrides', default=8, type=int,
+                        help='Number of texture override variants of every model of the overrides and textures packs')
+    parser.add_argument('-ts', '--texture_size', default=16, type=int, help='Size of the generated textures')
+    parser.add_argument('-r', '--repeat', default=3, type=int, help='Number of timed runs of every pack; the fastest is reported')
+    parser.add_argument('-ns', '--no_stages', dest='stages', default=True, action='store_false',
+                        help='Skip the extra profiled run (see convert_rsp.py --profile) that gives the time of every stage')
+    parser.add_argument('-c', '--check', default=False, action='store_true',
+                        help='Render every pack once more with one tile and no texture atlas, and list the icons that come out differently')
+    parser.add_argument('-j', '--jobs', default=DEFAULT_JOBS, type=int, metavar='N', help='Number of worker processes to render with')
+    parser.add_argument('-tl', '--tiles', default=1, type=int, metavar='K', help='Render K x K icons with every frame')
+    parser.add_argument('-si', '--size', default=128, type=int, help='Output size')
+    parser.add_argument('-ta', '--texture_atlas', default=False, action='store_true',
+                        help='Render with the textures of every batch packed into a texture atlas (see convert_rsp.py --texture_atlas)')
+    parser.add_argument('-w', '--work_path', default=None,
+                        help='Folder to generate the packs and render into; a temporary folder by default')
+    parser.add_argument('-o', '--output_file', default=None, help='JSON file to write the results to, instead of printing them')
+    parser.add_argument('-b', '--baseline_file', default=None,
+                        help='Results of an earlier benchmark (see --output_file), to print the change in models per second against')
+
+    return BenchmarkOptions(parser.parse_args(sys.argv[1:]))
@@ -0,0 +1,153 @@
+import hashlib
+import json
+import os
+
+from helper.manifest import hash_file
+from helper.model import ModelJSON, get_path_from_model_id, is_generated_item
+from helper.tints import find_leaf_tint
+
+
+def get_texture_files(model: ModelJSON, rsp_base_path, mc_rsp_base_path, texture_overrides=None):
+    '''
+    :param texture_overrides: Map of texture name to texture file path to use instead of the models texture
+    :return: Map of texture name to the texture file the model renders it with, or None if the texture is never defined
+    '''
+    if texture_overrides is None:
+        texture_overrides = {}
+
+    texture_files = {}
+    for texture in model.textures:
+        if texture.name in texture_overrides:
+            texture_files[texture.name] = texture_overrides[texture.name]
+        elif texture.texture_ref.startswith('#'):
+            texture_files[texture.name] = None
+        else:
+            texture_files[texture.name] = get_path_from_model_id(texture.texture_ref, rsp_base_path, mc_rsp_base_path,
+                                                                 '.png', type='textures')
+
+    return texture_files
+
+
+def get_geometry_fingerprint(model: ModelJSON, view):
+    '''
+    Fingerprints everything about a render of the model except the texture images: elements, display transform,
+    lighting, tint and the layout of the (animated) textures. Models with the same fingerprint only need to be loaded
+    once, with their textures swapped in (see Renderer.render_variant).
+    :return: Hex digest of the geometry
+    '''
+    elements = []
+    for element in model.elements:
+        faces = [[name, face.uvs, face.texture, face.rotation, face.tint_index]
+                 for name, face in sorted(element.faces.items())]
+        rotation = element.rotation
+        elements.append([element.voxel_from, element.voxel_to,
+                         [rotation.origin, rotation.axis, rotation.angle, rotation.rescale], faces])
+
+    position = model.display.get(view)
+    geometry = {
+        'elements': elements,
+        'display': [position.rotation, position.translation, position.scale] if position is not None else None,
+        'gui_light': model.gui_light,
+        'generated': is_generated_item(model),
+        'tint': find_leaf_tint(model.full_id_path),
+        'textures': sorted([texture.name, texture.v_scale, [frame.v_offset for frame in texture.animation_frames]]
+                           for texture in model.textures),
+    }
+
+    return hashlib.sha1(json.dumps(geometry, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def get_texture_fingerprint(texture_files):
+    '''
+    :param texture_files: Map of texture name to texture file (see get_texture_files)
+    :return: Hex digest of the texture contents, by name
+    '''
+    textures = []
+    for name, texture_file in sorted(texture_files.items()):
+        content_hash = hash_file(texture_file) if texture_file is not None else None
+        # Missing files can't be told apart by their contents
+        textures.append([name, content_hash if content_hash is not None else texture_file])
+
+    return hashlib.sha1(json.dumps(textures).encode('utf-8')).hexdigest()
+
+
+class RenderTarget:
+    '''
+    A single image to render, and every output file it gets written to. Targets of different models end up sharing a
+    RenderTarget when they would render the same pixels.
+    '''
+
+    def __init__(self, texture_files):
+        self.texture_files = texture_files  # Map of texture name to texture file (see get_texture_files)
+        self.output_files = []
+        self.resource_ids = []  # Every model id that wants this image
+
+
+class RenderBatch:
+    '''
+    Every RenderTarget sharing the same geometry. The batch is loaded from one of its models, and every target is
+    rendered from that by swapping in its textures.
+    '''
+
+    def __init__(self, resource_id, parents=(), num_elements=0):
+        self.resource_id = resource_id  # Model id to load the geometry from
+        self.parents = tuple(parents)  # Ids of the parent models of the model, root first
+        self.num_elements = num_elements  # Number of elements of the model
+        self.targets = {}  # Map of texture fingerprint to RenderTarget
+
+    def get_resource_ids(self):
+        resource_ids = []
+        for target in self.targets.values():
+            resource_ids.extend(resource_id for resource_id in target.resource_ids if resource_id not in resource_ids)
+        return resource_ids
+
+    def get_texture_files(self):
+        '''
+        :return: Set of every existing texture file any target of the batch is rendered with
+        '''
+        return set(texture_file for target in self.targets.values() for texture_file in target.texture_files.values()
+                   if texture_file is not None and os.path.exists(texture_file))
+
+
+class RenderPlanner:
+    '''
+    Collects every render of a batch run, and merges renders of models that resolve to the same geometry and textures,
+    so each unique image is only rendered once and then copied to every output file.
+    '''
+
+    def __init__(self, rsp_base_path, mc_rsp_base_path, view):
+        self.rsp_base_path = rsp_base_path
+        self.mc_rsp_base_path = mc_rsp_base_path
+        self.view = view
+        self.batches = {}  # Map of geometry fingerprint to RenderBatch
+
+    def add(self, resource_id, model: ModelJSON, texture_overrides, output_files):
+        '''
+        :param resource_id: Model id of the model
+        :param model: Fully loaded model json (see load_model_json and fill_frame_data)
+        :param texture_overrides: Map of texture name to texture file path to use instead of the models texture
+        :param output_files: Files the render gets written to
+        '''
+        if len(output_files) == 0:
+            return
+
+        geometry_fingerprint = get_geometry_fingerprint(model, self.view)
+        if geometry_fingerprint not in self.batches:
+            self.batches[geometry_fingerprint] = RenderBatch(resource_id, model.full_id_path[:-1], len(model.elements))
+        batch = self.batches[geometry_fingerprint]
+
+        texture_files = get_texture_files(model, self.rsp_base_path, self.mc_rsp_base_path, texture_overrides)
+        texture_fingerprint = get_texture_fingerprint(texture_files)
+        if texture_fingerprint not in batch.targets:
+            batch.targets[texture_fingerprint] = RenderTarget(texture_files)
+        target = batch.targets[texture_fingerprint]
+
+        target.output_files.extend(output_files)
+        if resource_id not in target.resource_ids:
+            target.resource_ids.append(resource_id)
+
+    def get_batches(self):
+        return list(self.batches.values())
+
+    def get_num_renders(self):
+        return sum(len(batch.targets) for batch in self.batches.values())
@@ -0,0 +1,228 @@
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+profiler = None  # Profiler of this process, or None while profiling is off
+
+# tracemalloc.reset_peak needs python 3.9, and threading.get_native_id 3.8. Without reset_peak, the peak of a stage is
+# the memory still allocated as it ends
+CAN_RESET_PEAK = hasattr(tracemalloc, 'reset_peak')
+get_thread_id = getattr(threading, 'get_native_id', threading.get_ident)
+
+
+class NoStage:
+    '''
+    Stage that records nothing; what stage returns while profiling is off.
+    '''
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NO_STAGE = NoStage()
+
+
+class ProfileStage:
+    '''
+    Times one stage, and when tracing memory, tracks the peak Python heap memory allocated while it runs. Nested stages
+    report their peak to the stage around them, since measuring a stage resets the peak tracemalloc keeps.
+    '''
+
+    def __init__(self, profiler, name, args):
+        self.profiler = profiler
+        self.name = name
+        self.args = args
+        self.start = 0
+        self.start_memory = 0
+        self.peak_memory = 0  # Highest peak of the stages nested in this one
+
+    def __enter__(self):
+        if self.profiler.trace_memory:
+            self.start_memory = tracemalloc.get_traced_memory()[0]
+            self.peak_memory = self.start_memory
+            if CAN_RESET_PEAK:
+                tracemalloc.reset_peak()
+        self.profiler.stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        end = time.perf_counter()
+        self.profiler.stack.pop()
+        peak_memory = None
+        if self.profiler.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            peak = max(peak if CAN_RESET_PEAK else current, self.peak_memory)
+            if len(self.profiler.stack) > 0:
+                parent = self.profiler.stack[-1]
+                parent.peak_memory = max(parent.peak_memory, peak)
+            peak_memory = peak - self.start_memory
+        self.profiler.add_event(self.name, self.start, end, peak_memory, self.args)
+        return False
+
+
+class Profiler:
+    '''
+    Records a Chrome trace event for every stage run in this process (see stage).
+    '''
+
+    def __init__(self, trace_memory=False):
+        '''
+        :param trace_memory: Also record the peak Python heap memory of every stage. tracemalloc slows down everything
+        that allocates Python objects, so the times of a run tracing memory are off
+        '''
+        self.pid = os.getpid()
+        self.trace_memory = trace_memory
+        self.stack = []  # Stages currently running, innermost last
+        self.events = []
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def add_event(self, name, start, end, peak_memory=None, args=None):
+        '''
+        :param peak_memory: Peak Python heap memory in bytes, or None when not tracing memory
+        '''
+        event = {
+            'name': name,
+            'ph': 'X',
+            'ts': start * 1000000,
+            'dur': (end - start) * 1000000,
+            'pid': self.pid,
+            'tid': get_thread_id(),
+            'args': {},
+        }
+        if peak_memory is not None:
+            event['args']['py_heap_peak_kb'] = peak_memory / 1024
+        if args is not None:
+            event['args'].update(args)
+        self.events.append(event)
+
+    def pop_events(self):
+        '''
+        :return: Every event recorded since the last call; workers hand these back to the main process with their results
+        '''
+        events = self.events
+        self.events = []
+        return events
+
+
+def enable_profiling(trace_memory=False):
+    '''
+    Starts recording stages in this process, dropping anything recorded before (e.g. events a forked worker inherited).
+    :param trace_memory: Also record the peak Python heap memory of every stage (see Profiler)
+    '''
+    global profiler
+    profiler = Profiler(trace_memory)
+
+
+def is_profiling():
+    return profiler is not None
+
+
+def stage(name, **args):
+    '''
+    :param args: Extra values to show with the event in the trace, e.g. the model being rendered
+    :return: Context manager that records the wall time (and, when tracing memory, the peak Python heap memory) of the
+    code it wraps, as the given stage; does nothing while profiling is off
+    '''
+    if profiler is None:
+        return NO_STAGE
+    return ProfileStage(profiler, name, args or None)
+
+
+def pop_events():
+    return profiler.pop_events() if profiler is not None else []
+
+
+def get_max_rss_kb():
+    '''
+    :return: Peak resident memory of this process, including what panda allocates outside of Python; None where the
+    resource module doesn't exist (Windows)
+    '''
+    try:
+        import resource
+    except ImportError:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def record_memory():
+    '''
+    Adds the peak resident memory of this process so far to the trace, as a counter
+    '''
+    max_rss_kb = get_max_rss_kb()
+    if profiler is not None and max_rss_kb is not None:
+        profiler.events.append({'name': 'max_rss', 'ph': 'C', 'ts': time.perf_counter() * 1000000,
+                                'pid': profiler.pid, 'args': {'kB': max_rss_kb}})
+
+
+def get_stage_summary(events):
+    '''
+    :return: Map of stage name to map of count, total, mean and max wall time in ms, and max peak Python heap memory in
+    kB (None when memory wasn't traced). Times include the stages nested in a stage.
+    '''
+    summary = {}
+    for event in events:
+        if event.get('ph') != 'X':
+            continue
+        stats = summary.setdefault(event['name'], {'count': 0, 'total_ms': 0, 'max_ms': 0, 'py_heap_peak_kb': None})
+        ms = event['dur'] / 1000
+        stats['count'] += 1
+        stats['total_ms'] += ms
+        stats['max_ms'] = max(stats['max_ms'], ms)
+        if 'py_heap_peak_kb' in event['args']:
+            stats['py_heap_peak_kb'] = max(stats['py_heap_peak_kb'] or 0, event['args']['py_heap_peak_kb'])
+
+    for stats in summary.values():
+        stats['mean_ms'] = stats['total_ms'] / stats['count']
+    return summary
+
+
+def get_max_rss_kb_of_events(events):
+    '''
+    :return: Highest peak resident memory any process recorded (see record_memory), or None if none did
+    '''
+    return max((event['args']['kB'] for event in events if event.get('name') == 'max_rss'), default=None)
+
+
+def format_stage_summary(summary, max_rss_kb=None):
+    '''
+    :param max_rss_kb: Peak resident memory to print below the stages, e.g. from get_max_rss_kb_of_events
+    '''
+    lines = [f'{"stage":<20} {"count":>7} {"total ms":>11} {"mean ms":>9} {"max ms":>9} {"py heap peak kB":>16}']
+    for name, stats in sorted(summary.items(), key=lambda item: -item[1]['total_ms']):
+        peak = stats['py_heap_peak_kb']
+        lines.append(f'{name:<20} {stats["count"]:>7} {stats["total_ms"]:>11.1f} {stats["mean_ms"]:>9.2f} '
+                     f'{stats["max_ms"]:>9.2f} {"-" if peak is None else format(peak, ".1f"):>16}')
+    if max_rss_kb is not None:
+        lines.append(f'Peak resident memory of the biggest process: {max_rss_kb} kB')
+    return '\n'.join(lines)
+
+
+def save_trace(path, events, metadata=None):
+    '''
+    Writes the events as a Chrome trace (chrome://tracing, or https://ui.perfetto.dev), with the per stage summary (see
+    get_stage_summary) alongside them.
+    :param metadata: Extra json serializable values to save with the trace
+    '''
+    # The clock is shared by every process, so the workers line up; start the trace at 0
+    start = min((event['ts'] for event in events), default=0)
+    trace_events = [dict(event, ts=event['ts'] - start) for event in events]
+    for pid in sorted(set(event['pid'] for event in events)):
+        name = 'main' if pid == os.getpid() else f'worker {pid}'
+        trace_events.append({'name': 'process_name', 'ph': 'M', 'pid': pid, 'args': {'name': name}})
+
+    trace = {
+        'traceEvents': trace_events,
+        'displayTimeUnit': 'ms',
+        'otherData': dict(metadata or {}, summary=get_stage_summary(events)),
+    }
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as trace_file:
+        json.dump(trace, trace_file)
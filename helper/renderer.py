@@ -0,0 +1,508 @@
+import os
+
+import numpy
+from PIL import Image
+from direct.showbase.ShowBase import ShowBase
+from panda3d.core import AmbientLight, ColorAttrib, CSYupRight, DirectionalLight, Geom, GeomTriangles, GeomVertexData, \
+    InternalName, NodePath, OrthographicLens, TexMatrixAttrib, TextureAttrib, TextureStage, TransformState, loadPrcFileData
+
+from helper.geometry import build_model_node, get_quad_indices
+from helper.model import ModelJSON, ModelJSONPosition, is_generated_item
+from helper.profiling import stage
+from helper.sprites import BUFFER_CLEAR_COLOR
+from helper.textures import get_texture_cache
+from helper.transform import get_light_one_vec, get_light_zero_vec, get_light_zero_item_vec, get_light_one_item_vec
+
+
+class RenderTile:
+    '''
+    One render buffer of the renderer, with its own scene, camera and lights. The scene isn't part of the ShowBase
+    scene graph, so the tiles of a renderer can't see each other's models.
+    '''
+
+    def __init__(self, renderer):
+        '''
+        :param renderer: Renderer owning the tile
+        '''
+        self.rsp_path = renderer.rsp_path
+        self.mc_base_rsp_path = renderer.mc_base_rsp_path
+
+        # Same render state as the ShowBase scene graph
+        self.root = NodePath('tile')
+        self.root.setState(renderer.base.render.getState())
+
+        self.lens = OrthographicLens()
+        self.lens.setCoordinateSystem(CSYupRight)
+        self.lens.setFar(100)
+        self.lens.setNear(0)
+        # A buffer of its own rather than a region of a shared one: the software renderer rounds vertex positions
+        # differently away from the buffer's corner, which changes the odd pixel where faces meet
+        self.buffer = renderer.base.win.makeTextureBuffer('tile', renderer.size, renderer.size, None, True)
+        self.buffer.setClearColor(BUFFER_CLEAR_COLOR)
+        self.buffer.setSort(-100)
+        self.buffer.setActive(False)
+        self.camera = renderer.base.makeCamera(self.buffer, lens=self.lens)
+
+        self.scene = NodePath("MyScene")
+        self.camera.reparentTo(self.scene)
+
+        light_zero = DirectionalLight('lightone')
+        light_zero.setColor((0.6, 0.6, 0.6, 1))
+
+        light_one = DirectionalLight('lightone')
+        light_one.setColor((0.6, 0.6, 0.6, 1))
+
+        alight = AmbientLight('alight')
+        alight.setColor((0.5, 0.5, 0.5, 1))
+        alnp = self.root.attachNewNode(alight)
+        self.root.setLight(alnp)
+
+        self.light_zero = self.root.attachNewNode(light_zero)
+        self.light_one = self.root.attachNewNode(light_one)
+
+        self.scene.reparentTo(self.root)
+
+        self.panda_model = None
+        self.model = None  # Model json the loaded panda model was built from
+        self.geom_texture_names = []  # Texture name of every Geom of the loaded panda model; None if it samples the atlas
+        self.geom_textures = []  # Texture every Geom of the loaded panda model was built with
+        self.texture_atlas = None  # TextureAtlas the loaded panda model was built with, if any
+        self.atlas_ranges = []  # AtlasRange of every texture of the loaded panda model taken from the texture atlas
+        self.atlas_range_paths = []  # Texture the uvs of every AtlasRange currently point at
+        self.atlas_vertex_data = {}  # Map of the Geom index of AtlasRanges to the vertex data of their Geoms
+        self.texture_order = []  # Order the textures would be drawn in without the atlas (see build_model_node)
+        self.geom_tints = []  # Flat ColorAttrib every Geom of the loaded panda model was built with; None if untinted
+
+    def load_model(self, model: ModelJSON, texture_overrides=None, texture_atlas=None):
+        '''
+        Builds the panda model for the given model json, replacing any previously loaded model. It only gets into the
+        scene once load applies the view and lighting for it.
+        :param model: Fully loaded model json (see load_model_json and fill_frame_data)
+        :param texture_overrides: Map of texture name to texture file path to use instead of the models texture
+        :param texture_atlas: TextureAtlas to take the textures from (see build_model_node)
+        :return: The loaded panda model
+        '''
+        if texture_overrides is None:
+            texture_overrides = {}
+
+        self.clear_model()
+        self.model = model
+
+        with stage('build_geometry'):
+            panda_model, self.geom_texture_names, self.atlas_ranges, self.texture_order = build_model_node(
+                self.rsp_path, self.mc_base_rsp_path, model, texture_overrides, texture_atlas)
+        self.atlas_range_paths = [atlas_range.texture_path for atlas_range in self.atlas_ranges]
+        self.texture_atlas = texture_atlas
+        geom_node = panda_model.node()
+        self.geom_textures = [geom_node.getGeomState(i).getAttrib(TextureAttrib).getTexture()
+                              for i in range(geom_node.getNumGeoms())]
+        self.geom_tints = [geom_node.getGeomState(i).getAttrib(ColorAttrib) for i in range(geom_node.getNumGeoms())]
+
+        if not is_generated_item(model):
+            panda_model.setHpr(0, -90, 0)
+
+        with stage('flatten'):
+            panda_model.flattenLight()
+
+        self.panda_model = panda_model
+        return panda_model
+
+    def apply_view(self, model: ModelJSON, view, scale_to_fit):
+        if view not in model.display:
+            print('Position "' + view + '" not found; Using default view (no rotation, scale, or translation)')
+            model.display[view] = ModelJSONPosition()
+
+        panda_model = self.panda_model
+        position = model.display[view]
+
+        with stage('flatten'):
+            panda_model.setScale(position.scale[0], position.scale[1], position.scale[2])
+            panda_model.flattenLight()
+
+            panda_model.setHpr(position.rotation[2], 0, 0)
+            panda_model.flattenLight()
+
+            panda_model.setHpr(0, 0, position.rotation[1])
+            panda_model.flattenLight()
+
+            panda_model.setHpr(0, position.rotation[0], 0)
+            panda_model.flattenLight()
+
+            panda_model.setPos(position.translation[0], position.translation[1], position.translation[2])
+            panda_model.flattenLight()
+
+        if scale_to_fit:
+            min_point, max_point = panda_model.getTightBounds()
+            film_size = max(max_point.getX() - min_point.getX(), max_point.getY() - min_point.getY())
+            self.lens.setFilmSize(film_size, film_size)
+            self.camera.setPos((max_point.getX() - min_point.getX()) / 2 + min_point.getX(),
+                               (max_point.getY() - min_point.getY()) / 2 + min_point.getY(), 32)
+        else:
+            self.lens.setFilmSize(16, 16)
+            self.camera.setPos(0, 0, 32)
+
+    def apply_lighting(self, model: ModelJSON):
+        if model.gui_light == 'front':
+            l0_vec = get_light_zero_item_vec()[:3]
+            l1_vec = get_light_one_item_vec()[:3]
+        else:
+            l0_vec = get_light_zero_vec()[:3]
+            l1_vec = get_light_one_vec()[:3]
+
+        self.light_zero.node().setDirection(l0_vec)
+        self.light_one.node().setDirection(l1_vec)
+
+        if model.gui_light == 'front':
+            self.light_zero.setHpr(0, -90, 0)
+            self.light_one.setHpr(0, -90, 0)
+        else:
+            self.light_zero.setHpr(90, 0, 0)
+            self.light_one.setHpr(90, 0, 0)
+
+        self.panda_model.setLight(self.light_one)
+        self.panda_model.setLight(self.light_zero)
+
+    def set_texture_overrides(self, texture_overrides=None):
+        '''
+        Rebinds the textures of the loaded panda model, without rebuilding its geometry. Textures that aren't overridden
+        go back to the ones the model was loaded with.
+        :param texture_overrides: Map of texture name to texture file path to use instead of the models texture
+        '''
+        if texture_overrides is None:
+            texture_overrides = {}
+
+        geom_node = self.panda_model.node()
+        for i, texture_name in enumerate(self.geom_texture_names):
+            if texture_name is None:
+                continue
+            if texture_name in texture_overrides:
+                texture = get_texture_cache().get(os.path.abspath(texture_overrides[texture_name]))
+            else:
+                texture = self.geom_textures[i]
+
+            geom_node.setGeomState(i, geom_node.getGeomState(i).setAttrib(TextureAttrib.make(texture)))
+
+        if len(self.atlas_ranges) > 0:
+            self.set_atlas_textures(texture_overrides)
+
+    def set_atlas_textures(self, texture_overrides):
+        '''
+        Points the uvs of the textures taken from the texture atlas at the rects of the given textures in the atlas.
+        :param texture_overrides: See set_texture_overrides; every texture given must be in the atlas
+        '''
+        changed = {}  # Map of the Geom index of the ranges (see AtlasRange) to list of tuple (AtlasRange, texture path)
+        for i, atlas_range in enumerate(self.atlas_ranges):
+            if atlas_range.texture_name in texture_overrides:
+                texture_path = os.path.abspath(texture_overrides[atlas_range.texture_name])
+            else:
+                texture_path = atlas_range.texture_path
+            if texture_path == self.atlas_range_paths[i]:
+                continue
+            if not self.texture_atlas.has_texture(texture_path):
+                raise Exception(f'{texture_path} isn\'t in the texture atlas of the loaded model; load it again')
+            changed.setdefault(atlas_range.geom_index, []).append((atlas_range, texture_path))
+            self.atlas_range_paths[i] = texture_path
+
+        for geom_index, ranges in changed.items():
+            vertex_data = self.atlas_vertex_data[geom_index]
+            array_format = vertex_data.getFormat().getArray(0)
+            stride = array_format.getStride() // 4
+            texcoord = array_format.getColumn(InternalName.getTexcoord()).getStart() // 4
+
+            handle = vertex_data.modifyArrayHandle(0)
+            rows = numpy.frombuffer(handle.getData(), dtype=numpy.float32).reshape((-1, stride)).copy()
+            for atlas_range, texture_path in ranges:
+                end = atlas_range.start + len(atlas_range.u)
+                rows[atlas_range.start:end, texcoord], rows[atlas_range.start:end, texcoord + 1] = \
+                    self.texture_atlas.remap_uvs(texture_path, atlas_range.u, atlas_range.v)
+            handle.copyDataFrom(rows)
+
+    def make_atlas_geom(self, geom_index, ranges):
+        '''
+        :return: Geom drawing the given textures taken from the texture atlas, in order
+        '''
+        first = numpy.concatenate([numpy.arange(atlas_range.start, atlas_range.start + len(atlas_range.u), 4,
+                                                dtype=numpy.uint32) for atlas_range in ranges])
+        triangles = GeomTriangles(Geom.UHStatic)
+        triangles.setIndexType(Geom.NT_uint32)
+        triangles.modifyVertices().modifyHandle().copyDataFrom(get_quad_indices(first))
+        geom = Geom(self.atlas_vertex_data[geom_index])
+        geom.addPrimitive(triangles)
+        return geom
+
+    def get_bin_depth(self, geom):
+        '''
+        :return: Where the transparent bin sorts the Geom: by the center of its bounds, as far from the camera, which
+        looks down -z, as panda computes it; the farthest Geom has the lowest depth
+        '''
+        return numpy.float32(geom.getBounds().getApproxCenter()[2]) - numpy.float32(self.camera.getZ())
+
+    def split_atlas_geoms(self):
+        '''
+        Splits every Geom that samples the texture atlas into runs of textures that the transparent bin would draw one
+        right after the other as Geoms of their own, and puts all Geoms in the order they get drawn in. The bin orders
+        Geoms back to front by the center of their bounds, and equally far ones in the order they are in (as long as
+        there are few enough for its sort to be stable); a run only takes another texture while the center of its
+        bounds stays between those of its first and last texture, so sharing Geoms doesn't change which faces get
+        drawn over which. Needs the view applied.
+        '''
+        self.atlas_vertex_data = {}
+        if len(self.atlas_ranges) == 0:
+            return
+
+        geom_node = self.panda_model.node()
+        for atlas_range in self.atlas_ranges:
+            if atlas_range.geom_index not in self.atlas_vertex_data:
+                # A copy the tile owns, shared by every Geom split off, so set_atlas_textures can change all their uvs
+                self.atlas_vertex_data[atlas_range.geom_index] = GeomVertexData(
+                    geom_node.getGeom(atlas_range.geom_index).getVertexData())
+
+        textures = []  # List of tuple (depth, Geom index, AtlasRange or None, Geom drawing only the texture)
+        for geom_index, atlas_range in self.texture_order:
+            if atlas_range is None:
+                geom = geom_node.getGeom(geom_index)
+            else:
+                geom = self.make_atlas_geom(geom_index, [atlas_range])
+            textures.append((self.get_bin_depth(geom), geom_index, atlas_range, geom))
+        # Stable, so equally far textures keep the order their own Geoms would have had
+        textures.sort(key=lambda texture: texture[0])
+
+        runs = []  # List of [Geom index, list of AtlasRange or None, Geom, depth of the first texture]
+        for depth, geom_index, atlas_range, geom in textures:
+            if atlas_range is not None and len(runs) > 0 and runs[-1][0] == geom_index and runs[-1][1] is not None:
+                run_geom = self.make_atlas_geom(geom_index, runs[-1][1] + [atlas_range])
+                if runs[-1][3] <= self.get_bin_depth(run_geom) <= depth:
+                    runs[-1][1].append(atlas_range)
+                    runs[-1][2] = run_geom
+                    continue
+            runs.append([geom_index, None if atlas_range is None else [atlas_range], geom, depth])
+
+        geom_states = [geom_node.getGeomState(i) for i in range(geom_node.getNumGeoms())]
+        geom_node.removeAllGeoms()
+        for geom_index, _, geom, _ in runs:
+            geom_node.addGeom(geom, geom_states[geom_index])
+        self.geom_texture_names = [self.geom_texture_names[geom_index] for geom_index, _, _, _ in runs]
+        self.geom_textures = [self.geom_textures[geom_index] for geom_index, _, _, _ in runs]
+        self.geom_tints = [self.geom_tints[geom_index] for geom_index, _, _, _ in runs]
+
+    def set_tint(self, tint=None):
+        '''
+        Changes the tint of the tinted faces (the ones with a tintindex) of the loaded model, without rebuilding it.
+        :param tint: (r, g, b) tint from 0 to 255, or None for the tint the model was loaded with (see find_leaf_tint)
+        '''
+        geom_node = self.panda_model.node()
+        for i, geom_tint in enumerate(self.geom_tints):
+            if geom_tint is None:
+                continue
+
+            if tint is not None:
+                geom_tint = ColorAttrib.makeFlat((tint[0] / 255, tint[1] / 255, tint[2] / 255, 1))
+            geom_node.setGeomState(i, geom_node.getGeomState(i).setAttrib(geom_tint))
+
+    def set_texture_frames(self, texture_frames=None):
+        '''
+        Steps animated textures of the loaded model to the given frames, by offsetting the uvs of their Geoms with a
+        texture matrix. Textures that aren't given go back to frame 0.
+        :param texture_frames: Map of texture name to animation frame index
+        '''
+        if texture_frames is None:
+            texture_frames = {}
+
+        def get_offset(texture_name):
+            animation_frames = self.model.get_texture_by_name(texture_name).animation_frames
+            return animation_frames[texture_frames.get(texture_name, 0)].v_offset - animation_frames[0].v_offset
+
+        if any(get_offset(atlas_range.texture_name) != 0 for atlas_range in self.atlas_ranges):
+            raise Exception('Textures taken from a texture atlas can\'t be animated')
+
+        geom_node = self.panda_model.node()
+        for i, texture_name in enumerate(self.geom_texture_names):
+            if texture_name is None:
+                continue
+            offset = get_offset(texture_name)
+
+            state = geom_node.getGeomState(i)
+            if offset == 0:
+                state = state.removeAttrib(TexMatrixAttrib)
+            else:
+                state = state.setAttrib(TexMatrixAttrib.make(TextureStage.getDefault(), TransformState.makePos2d((0, offset))))
+            geom_node.setGeomState(i, state)
+
+    def clear_model(self):
+        if self.panda_model is not None:
+            self.panda_model.removeNode()
+            self.panda_model = None
+            self.model = None
+            self.geom_texture_names = []
+            self.geom_textures = []
+            self.texture_atlas = None
+            self.atlas_ranges = []
+            self.atlas_range_paths = []
+            self.atlas_vertex_data = {}
+            self.texture_order = []
+            self.geom_tints = []
+        self.buffer.setActive(False)
+
+    def load(self, model: ModelJSON, view='gui', scale_to_fit=False, texture_overrides=None, texture_atlas=None):
+        '''
+        Loads the given model into the scene, ready to be captured. Variants that only differ in their textures can
+        then be rendered with render_variant, without loading the model again.
+        :param model: Fully loaded model json (see load_model_json and fill_frame_data)
+        :param view: Display transform to render with
+        :param scale_to_fit: Fit the camera to the bounds of the model, instead of the standard 16x16 area
+        :param texture_overrides: Map of texture name to texture file path to use instead of the models texture
+        :param texture_atlas: TextureAtlas to take the textures from (see build_model_node); render_variant can only
+        swap in textures that are in the atlas
+        '''
+        self.load_model(model, texture_overrides, texture_atlas)
+        self.apply_view(model, view, scale_to_fit)
+        self.split_atlas_geoms()
+        self.panda_model.reparentTo(self.scene)
+        self.apply_lighting(model)
+        self.buffer.setActive(True)
+
+    def read_pixels(self) -> numpy.ndarray:
+        '''
+        Reads the last frame rendered into the buffer straight back from its RAM copy.
+        :return: (height, width, 4) RGBA uint8 array, top row first
+        '''
+        texture = self.buffer.getTexture()
+        ram_image = texture.getRamImageAs('RGBA')
+        if not ram_image:
+            raise Exception('Failed to read back the render buffer')
+
+        pixels = numpy.frombuffer(ram_image, dtype=numpy.uint8).reshape((texture.getYSize(), texture.getXSize(), 4))
+        # Panda stores images bottom row first
+        return numpy.flipud(pixels)
+
+
+
+class Renderer:
+    '''
+    Owns a single offscreen ShowBase and render buffer. Models are swapped in and out of the scene for every render,
+    so any number of icons can be rendered without paying the Panda3D startup cost more than once per process.
+    With tiles > 1, there are tiles x tiles RenderTiles, so a whole grid of icons can be rendered with a single frame
+    (see render_tiles). Everything else renders with the first tile.
+    '''
+
+    def __init__(self, size, rsp_path, mc_base_rsp_path, tiles=1):
+        self.size = size
+        self.rsp_path = rsp_path
+        self.mc_base_rsp_path = mc_base_rsp_path
+        self.tiles_per_side = tiles
+
+        # Nothing is ever played, so don't bother opening an audio device
+        loadPrcFileData('', 'audio-library-name null')
+        self.base = ShowBase(windowType='offscreen')
+
+        self.base.set_background_color(0, 0, 0, 0)
+
+        self.tiles = [RenderTile(self) for _ in range(tiles * tiles)]
+
+    @property
+    def model(self):
+        return self.tiles[0].model
+
+    @property
+    def texture_atlas(self):
+        return self.tiles[0].texture_atlas
+
+    def load_model(self, model: ModelJSON, texture_overrides=None, texture_atlas=None):
+        return self.tiles[0].load_model(model, texture_overrides, texture_atlas)
+
+    def set_texture_overrides(self, texture_overrides=None):
+        self.tiles[0].set_texture_overrides(texture_overrides)
+
+    def set_tint(self, tint=None):
+        self.tiles[0].set_tint(tint)
+
+    def set_texture_frames(self, texture_frames=None):
+        self.tiles[0].set_texture_frames(texture_frames)
+
+    def clear_model(self):
+        self.tiles[0].clear_model()
+
+    def load(self, model: ModelJSON, view='gui', scale_to_fit=False, texture_overrides=None, texture_atlas=None):
+        '''
+        Loads the given model into the first tile (see RenderTile.load).
+        '''
+        self.tiles[0].load(model, view, scale_to_fit, texture_overrides, texture_atlas)
+
+    def render_variant(self, texture_overrides=None, tint=None) -> Image.Image:
+        '''
+        Renders the loaded model with the given textures and tint swapped in. The camera framing stays the same, since it
+        only depends on the geometry.
+        :param texture_overrides: Map of texture name to texture file path to use instead of the loaded texture
+        :param tint: (r, g, b) tint of the tinted faces from 0 to 255, or None for the model's own tint
+        :return: The rendered RGBA image
+        '''
+        self.set_texture_overrides(texture_overrides)
+        self.set_tint(tint)
+        return self.capture()
+
+    def render_frame(self, texture_frames=None) -> Image.Image:
+        '''
+        Renders the loaded model with its animated textures stepped to the given frames.
+        :param texture_frames: Map of texture name to animation frame index
+        :return: The rendered RGBA image
+        '''
+        self.set_texture_frames(texture_frames)
+        return self.capture()
+
+    def render(self, model: ModelJSON, view='gui', scale_to_fit=False, texture_overrides=None) -> Image.Image:
+        '''
+        Renders the given model.
+        :param model: Fully loaded model json (see load_model_json and fill_frame_data)
+        :param view: Display transform to render with
+        :param scale_to_fit: Fit the camera to the bounds of the model, instead of the standard 16x16 area
+        :param texture_overrides: Map of texture name to texture file path to use instead of the models texture
+        :return: The rendered RGBA image
+        '''
+        self.load(model, view, scale_to_fit, texture_overrides)
+        return self.capture()
+
+    def render_tiles(self, renders):
+        '''
+        Renders up to tiles x tiles models with a single frame, one per tile.
+        :param renders: List of tuple (model, view, scale_to_fit, texture_overrides, texture_atlas) (see load)
+        :return: List of the rendered RGBA image of every render, or None where the model failed to load
+        '''
+        if len(renders) > len(self.tiles):
+            raise Exception(f'Can\'t render {len(renders)} models with {len(self.tiles)} tiles')
+
+        loaded = []
+        for tile, (model, view, scale_to_fit, texture_overrides, texture_atlas) in zip(self.tiles, renders):
+            try:
+                tile.load(model, view, scale_to_fit, texture_overrides, texture_atlas)
+                loaded.append(True)
+            except Exception as e:
+                print('Render failed: ' + str(e))
+                tile.clear_model()
+                loaded.append(False)
+        for tile in self.tiles[len(renders):]:
+            tile.clear_model()
+
+        tile_pixels = self.capture_tiles(len(renders))
+        return [Image.fromarray(numpy.ascontiguousarray(pixels)) if loaded[i] else None
+                for i, pixels in enumerate(tile_pixels)]
+
+    def capture_array(self) -> numpy.ndarray:
+        '''
+        Renders a frame, and reads back the first tile.
+        :return: (height, width, 4) RGBA uint8 array, top row first
+        '''
+        return self.capture_tiles(1)[0]
+
+    def capture_tiles(self, count):
+        '''
+        Renders a frame, and reads back the first count tiles. Only tiles with a model loaded get rendered.
+        :return: List of (height, width, 4) RGBA uint8 array of every tile, top row first
+        '''
+        with stage('render_frame'):
+            self.base.graphicsEngine.renderFrame()
+
+        with stage('readback'):
+            return [tile.read_pixels() for tile in self.tiles[:count]]
+
+    def capture(self) -> Image.Image:
+        return Image.fromarray(numpy.ascontiguousarray(self.capture_array()))
@@ -0,0 +1,48 @@
+import numpy
+from PIL import Image
+
+DOWNSCALE_FILTER_BOX = 'box'
+DOWNSCALE_FILTER_LANCZOS = 'lanczos'
+DOWNSCALE_FILTER_NEAREST = 'nearest'
+
+DOWNSCALE_FILTERS = {
+    DOWNSCALE_FILTER_BOX: Image.BOX,
+    DOWNSCALE_FILTER_LANCZOS: Image.LANCZOS,
+    DOWNSCALE_FILTER_NEAREST: Image.NEAREST,
+}
+
+
+def downscale(image: Image.Image, width, filter=DOWNSCALE_FILTER_BOX) -> Image.Image:
+    '''
+    Downscales an RGBA image in memory, keeping its aspect ratio. Colors are premultiplied by alpha while filtering,
+    so fully transparent (black) pixels don't darken the edges of the icon.
+    :param image: Image to scale
+    :param width: Width of the scaled image
+    :param filter: One of DOWNSCALE_FILTERS
+    :return: The scaled RGBA image
+    '''
+    image = image.convert('RGBA')
+    size = (width, max(1, round(image.height * width / image.width)))
+    if size == image.size:
+        return image
+
+    resample = DOWNSCALE_FILTERS[filter]
+    if resample == Image.NEAREST:
+        # Nearest neighbour never mixes pixels, so there is nothing to premultiply
+        return image.resize(size, resample=resample)
+
+    pixels = numpy.asarray(image, dtype=numpy.float32) / 255
+    alpha = pixels[:, :, 3]
+    channels = [pixels[:, :, i] * alpha for i in range(3)] + [alpha]
+
+    scaled = numpy.stack([numpy.asarray(Image.fromarray(channel).resize(size, resample=resample))
+                          for channel in channels], axis=2)
+    # Lanczos can ring outside of the source range
+    scaled = numpy.clip(scaled, 0, 1)
+
+    scaled_alpha = scaled[:, :, 3:4]
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        scaled[:, :, :3] = numpy.where(scaled_alpha > 0, scaled[:, :, :3] / scaled_alpha, 0)
+    scaled = numpy.clip(scaled, 0, 1)
+
+    return Image.fromarray(numpy.round(scaled * 255).astype(numpy.uint8))
@@ -0,0 +1,140 @@
+import json
+import math
+import os
+
+from helper.planner import RenderBatch
+
+RENDER_COSTS_VERSION = 1
+
+# Weights of the cost estimate of a batch that has never been rendered, in arbitrary units per target (see
+# estimate_cost); they get calibrated to seconds against the batches that have been
+ESTIMATE_TARGET_COST = 1
+ESTIMATE_ELEMENT_COST = 1 / 8
+ESTIMATE_TEXTURE_BYTE_COST = 1 / (64 * 1024)
+
+# Jobs handed to every worker: enough for the longest first order to even out the workers, few enough that a job
+# still holds many neighbouring batches (see schedule_jobs)
+JOBS_PER_WORKER = 4
+
+
+class RenderCosts:
+    '''
+    How long every batch took to render in previous runs, by the model id it was loaded from. Used to start the most
+    expensive jobs first (see schedule_jobs).
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.costs = {}  # Map of model id to tuple (seconds, number of targets rendered in that time)
+
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as costs_file:
+                    costs = json.load(costs_file)
+                if costs.get('version') == RENDER_COSTS_VERSION:
+                    self.costs = {resource_id: tuple(cost) for resource_id, cost in costs['costs'].items()}
+            except ValueError:
+                print('Ignoring unreadable render cost file ' + path)
+
+    def get_seconds_per_target(self, resource_id):
+        seconds, num_targets = self.costs[resource_id]
+        return seconds / max(num_targets, 1)
+
+    def has_cost(self, resource_id):
+        return resource_id in self.costs
+
+    def record(self, resource_id, seconds, num_targets):
+        self.costs[resource_id] = (seconds, num_targets)
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as costs_file:
+            json.dump({'version': RENDER_COSTS_VERSION, 'costs': self.costs}, costs_file, indent=1, sort_keys=True)
+        os.replace(temp_path, self.path)
+
+
+def get_texture_bytes(batch: RenderBatch):
+    texture_files = set(texture_file for target in batch.targets.values()
+                        for texture_file in target.texture_files.values() if texture_file is not None)
+    return sum(os.path.getsize(texture_file) for texture_file in texture_files if os.path.exists(texture_file))
+
+
+def estimate_cost(batch: RenderBatch):
+    '''
+    :return: Cost of the batch in arbitrary units, from its element count, texture size and number of targets
+    '''
+    per_target = ESTIMATE_TARGET_COST + ESTIMATE_ELEMENT_COST * batch.num_elements + \
+        ESTIMATE_TEXTURE_BYTE_COST * get_texture_bytes(batch)
+    return per_target * len(batch.targets)
+
+
+def get_batch_costs(batches, render_costs: RenderCosts = None):
+    '''
+    :return: List of the expected cost of every batch, in seconds where any batch has a recorded cost. Batches without
+    one are estimated (see estimate_cost), scaled by how the estimates compared to the recorded costs.
+    '''
+    estimates = [estimate_cost(batch) for batch in batches]
+    if render_costs is None:
+        return estimates
+
+    recorded = [render_costs.get_seconds_per_target(batch.resource_id) * len(batch.targets)
+                if render_costs.has_cost(batch.resource_id) else None for batch in batches]
+    recorded_seconds = sum(cost for cost in recorded if cost is not None)
+    recorded_estimates = sum(estimate for estimate, cost in zip(estimates, recorded) if cost is not None)
+    scale = recorded_seconds / recorded_estimates if recorded_estimates > 0 and recorded_seconds > 0 else 1
+
+    return [cost if cost is not None else estimate * scale for estimate, cost in zip(estimates, recorded)]
+
+
+def get_locality_key(batch: RenderBatch):
+    '''
+    :return: Sort key that puts batches sharing parent models next to each other, and within those, batches sharing
+    textures; so a worker handed neighbouring batches finds them in its model and texture caches
+    '''
+    texture_files = sorted(set(texture_file for target in batch.targets.values()
+                               for texture_file in target.texture_files.values() if texture_file is not None))
+    return batch.parents, texture_files, batch.resource_id
+
+
+def schedule_jobs(batches, targets_per_job=1, render_costs: RenderCosts = None, num_workers=1):
+    '''
+    Orders the batches for locality, then groups neighbouring batches into jobs of at least targets_per_job targets.
+    With workers, jobs are made bigger, about JOBS_PER_WORKER per worker, so most neighbouring batches still end up in
+    the same worker's caches; those jobs then start the most expensive first, so a parallel run doesn't end waiting
+    on one slow job. The order only depends on the batches, so runs over the same pack render in the same order.
+    :param targets_per_job: Fewest targets in a job, e.g. a frame of tiles
+    :param render_costs: Costs of previous runs, to estimate the cost of every job with
+    :param num_workers: Number of worker processes the jobs get spread over
+    :return: List of jobs, each a list of RenderBatch
+    '''
+    batches = sorted(batches, key=get_locality_key)
+    costs = get_batch_costs(batches, render_costs)
+
+    if num_workers > 1:
+        num_targets = sum(len(batch.targets) for batch in batches)
+        frames_per_job = math.ceil(num_targets / (num_workers * JOBS_PER_WORKER) / targets_per_job)
+        targets_per_job *= max(frames_per_job, 1)
+
+    jobs = []
+    job = []
+    job_cost = 0
+    num_targets = 0
+    for batch, cost in zip(batches, costs):
+        job.append(batch)
+        job_cost += cost
+        num_targets += len(batch.targets)
+        if num_targets >= targets_per_job:
+            jobs.append((job, job_cost))
+            job = []
+            job_cost = 0
+            num_targets = 0
+
+    if len(job) > 0:
+        jobs.append((job, job_cost))
+
+    if num_workers > 1:
+        # Stable, so equally expensive jobs keep their locality order
+        jobs.sort(key=lambda job_and_cost: -job_and_cost[1])
+
+    return [job for job, _ in jobs]
@@ -0,0 +1,117 @@
+import os
+
+import numpy
+from PIL import Image
+
+from helper.model import ModelJSON, get_path_from_model_id
+from helper.textures import get_texture_cache
+
+# Color the render buffer is cleared to (see Renderer); fully transparent pixels keep it as their color
+BUFFER_CLEAR_COLOR = (0.41, 0.41, 0.41, 0)
+
+# The single element of builtin/generated (see extra/generated.json)
+GENERATED_FROM = (0, 0, 0)
+GENERATED_TO = (16, 0.001, 16)
+GENERATED_UP_UVS = (0, 0, 16, 16)
+
+
+def is_generated_sprite(model: ModelJSON, view):
+    '''
+    :return: Whether the model is a plain item/generated sprite, seen straight on: the only thing visible is the up face
+    of the builtin/generated element, exactly covering the 16x16 render area, facing the front light.
+    '''
+    full_id_path = model.full_id_path
+    if 'builtin/generated' not in full_id_path:
+        return False
+    if 'item/generated' not in full_id_path and 'minecraft:item/generated' not in full_id_path:
+        return False
+    if model.gui_light != 'front' or len(model.elements) != 1:
+        return False
+
+    position = model.display.get(view)
+    if position is not None and (any(value != 0 for value in position.rotation) or
+                                 any(value != 0 for value in position.translation) or
+                                 any(value != 1 for value in position.scale)):
+        return False
+
+    element = model.elements[0]
+    if tuple(element.voxel_from) != GENERATED_FROM or tuple(element.voxel_to) != GENERATED_TO:
+        return False
+    if element.rotation.angle != 0 or element.rotation.rescale:
+        return False
+
+    up = element.faces.get('up')
+    if up is None or tuple(up.uvs) != GENERATED_UP_UVS or up.rotation != 0 or up.tint_index is not None:
+        return False
+    # Faces after a tinted one are tinted as well (see get_quads_for_model), so any tint at all rules out the fast path
+    return all(face.tint_index is None for face in element.faces.values())
+
+
+def is_aligned(size, texels):
+    return size % texels == 0 or texels % size == 0
+
+
+def render_sprite(model: ModelJSON, size, view, rsp_base_path, mc_rsp_base_path, texture_overrides=None,
+                  texture_frames=None):
+    '''
+    Renders an item/generated sprite without the 3D pipeline, by scaling its texture with nearest neighbour sampling,
+    the same way the rasterizer samples it.
+    Only sprites that come out exactly as the 3D render would are handled. That rules out textures with partially
+    transparent pixels, since those get blended with the buffer's clear color, and sizes that aren't a multiple (or a
+    divisor) of the texture size.
+    :param model: Fully loaded model json (see load_model_json and fill_frame_data)
+    :param size: Width and height of the image
+    :param view: Display transform to render with
+    :param texture_overrides: Map of texture name to texture file path to use instead of the models texture
+    :param texture_frames: Map of texture name to the animation frame index to render; frame 0 by default
+    :return: The rendered RGBA image, or None if the model has to go through the 3D renderer
+    '''
+    if texture_overrides is None:
+        texture_overrides = {}
+    if texture_frames is None:
+        texture_frames = {}
+
+    if not is_generated_sprite(model, view):
+        return None
+
+    texture_name = model.elements[0].faces['up'].texture[1:]
+    if not model.has_texture(texture_name):
+        return None
+    model_texture = model.get_texture_by_name(texture_name)
+
+    if texture_name in texture_overrides:
+        texture_path = os.path.abspath(texture_overrides[texture_name])
+    else:
+        texture_path = get_path_from_model_id(model_texture.texture_ref, rsp_base_path, mc_rsp_base_path, '.png',
+                                              type='textures')
+
+    # Use the texture exactly as panda would, e.g. after rescaling to a power of two
+    texture = get_texture_cache().get(texture_path)
+    texels = numpy.frombuffer(texture.getRamImageAs('RGBA'), dtype=numpy.uint8).reshape(
+        (texture.getYSize(), texture.getXSize(), 4))  # Bottom row first
+
+    # Where texel edges don't line up with pixel edges, the rasterizer's rounding decides which texel a pixel gets
+    width = texture.getXSize()
+    frame_height = texture.getYSize() * model_texture.v_scale
+    if not is_aligned(size, width) or frame_height != int(frame_height) or not is_aligned(size, int(frame_height)):
+        return None
+
+    # Texture coordinates at the center of every pixel; the top left corner of the image has u = 0, v = 1
+    centers = (numpy.arange(size) + 0.5) / size
+    u = centers
+    v = model_texture.get_transformed_v_coord(1 - centers, texture_frames.get(texture_name, 0))
+
+    columns = numpy.floor(u * width).astype(int) % width
+    rows = numpy.floor(v * texture.getYSize()).astype(int) % texture.getYSize()
+
+    # Check and fix up the (small) texture first, then scale it up in one go
+    sampled_alpha = texels[numpy.unique(rows)][:, numpy.unique(columns), 3]
+    if not numpy.all((sampled_alpha == 0) | (sampled_alpha == 255)):
+        return None
+
+    texels = texels.copy()
+    texels[texels[:, :, 3] == 0, :3] = [round(channel * 255) for channel in BUFFER_CLEAR_COLOR[:3]]
+
+    # Gather whole RGBA pixels at once
+    pixels = texels.view(numpy.uint32)[:, :, 0].take(rows, axis=0).take(columns, axis=1)
+    return Image.fromarray(pixels.view(numpy.uint8).reshape((size, size, 4)))
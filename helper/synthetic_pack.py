@@ -0,0 +1,161 @@
+import json
+import os
+
+import numpy
+from PIL import Image
+
+PACK_SHAPE_GENERATED = 'generated'  # Flat item/generated sprites
+PACK_SHAPE_PARENTS = 'parents'  # Block models at the end of a long chain of parents
+PACK_SHAPE_ELEMENTS = 'elements'  # Block models with many rotated elements
+PACK_SHAPE_ANIMATED = 'animated'  # Items with animated textures
+PACK_SHAPE_OVERRIDES = 'overrides'  # Items mapped to many names, most of them with texture overrides
+PACK_SHAPE_TEXTURES = 'textures'  # Block models with a texture per face direction, mapped to texture override variants
+PACK_SHAPES = [PACK_SHAPE_GENERATED, PACK_SHAPE_PARENTS, PACK_SHAPE_ELEMENTS, PACK_SHAPE_ANIMATED, PACK_SHAPE_OVERRIDES,
+               PACK_SHAPE_TEXTURES]
+
+FACES = ['down', 'up', 'north', 'south', 'west', 'east']
+ROTATION_AXES = ['x', 'y', 'z']
+ROTATION_ANGLES = [-45, -22.5, 0, 22.5, 45]
+
+IDENTITY_GUI_DISPLAY = {'gui': {'rotation': [0, 0, 0], 'translation': [0, 0, 0], 'scale': [1, 1, 1]}}
+BLOCK_GUI_DISPLAY = {'gui': {'rotation': [30, 225, 0], 'translation': [0, 0, 0], 'scale': [0.625, 0.625, 0.625]}}
+
+
+class SyntheticPack:
+    def __init__(self, path, shape):
+        self.shape = shape
+        self.rsp_path = os.path.join(path, 'rsp')
+        self.mc_base_rsp_path = os.path.join(path, 'mc')
+        self.map_file = os.path.join(path, 'map.json')  # File name map of every model of the pack (see convert_rsp)
+        self.num_models = 0
+        self.num_renders = 0  # Number of output names in the file name map
+
+
+def write_json(path, value):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as json_file:
+        json.dump(value, json_file)
+
+
+def write_texture(path, rng: numpy.random.Generator, size, num_frames=1):
+    '''
+    Writes a texture of random colors, every pixel either opaque or fully transparent.
+    :param num_frames: Number of size x size frames in the strip
+    '''
+    pixels = rng.integers(0, 256, (size * num_frames, size, 4), dtype=numpy.uint8)
+    pixels[:, :, 3] = numpy.where(pixels[:, :, 3] < 64, 0, 255)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    Image.fromarray(pixels).save(path)
+
+
+def write_base_pack(mc_path):
+    '''
+    Writes the handful of parent models of the default pack that every shape builds on.
+    '''
+    models_path = os.path.join(mc_path, 'assets', 'minecraft', 'models')
+    write_json(os.path.join(models_path, 'item', 'generated.json'),
+               {'parent': 'builtin/generated', 'gui_light': 'front', 'display': IDENTITY_GUI_DISPLAY})
+    write_json(os.path.join(models_path, 'block', 'block.json'), {'gui_light': 'side', 'display': BLOCK_GUI_DISPLAY})
+
+
+def get_element(rng: numpy.random.Generator, texture='#all'):
+    '''
+    :param texture: Texture of every face, or None for the texture named after the face direction
+    :return: Element json of a random box, rotated about a random axis
+    '''
+    start = rng.integers(0, 12, 3)
+    end = start + rng.integers(1, 5, 3)
+    faces = {}
+    for face in FACES:
+        faces[face] = {'texture': texture or '#' + face}
+        if rng.random() < 0.25:
+            faces[face]['tintindex'] = 0
+    return {
+        'from': start.tolist(),
+        'to': end.tolist(),
+        'rotation': {'origin': [8, 8, 8], 'axis': ROTATION_AXES[rng.integers(len(ROTATION_AXES))],
+                     'angle': ROTATION_ANGLES[rng.integers(len(ROTATION_ANGLES))]},
+        'faces': faces,
+    }
+
+
+def generate_pack(path, shape, num_models, parent_depth=8, num_elements=32, num_frames=8, num_overrides=8,
+                  texture_size=16, seed=0) -> SyntheticPack:
+    '''
+    Writes a resource pack of num_models models of the given shape, the default pack they build on, and a file name map
+    of all of them. The same arguments always give the same pack.
+    :param shape: One of PACK_SHAPES
+    :param parent_depth: Number of parents between every model and block/block, with PACK_SHAPE_PARENTS
+    :param num_elements: Number of elements of every model, with PACK_SHAPE_ELEMENTS and PACK_SHAPE_TEXTURES
+    :param num_frames: Number of frames of every texture, with PACK_SHAPE_ANIMATED
+    :param num_overrides: Number of texture override variants of every model, with PACK_SHAPE_OVERRIDES and
+    PACK_SHAPE_TEXTURES
+    '''
+    rng = numpy.random.default_rng(seed)
+    pack = SyntheticPack(path, shape)
+    write_base_pack(pack.mc_base_rsp_path)
+
+    assets_path = os.path.join(pack.rsp_path, 'assets', 'minecraft')
+    models_path = os.path.join(assets_path, 'models')
+    textures_path = os.path.join(assets_path, 'textures')
+
+    override_textures = []
+    if shape in (PACK_SHAPE_OVERRIDES, PACK_SHAPE_TEXTURES):
+        for k in range(num_overrides):
+            override_texture = os.path.abspath(os.path.join(path, 'overrides', f'variant_{k}.png'))
+            write_texture(override_texture, rng, texture_size)
+            override_textures.append(override_texture)
+
+    file_name_map = {}
+    for i in range(num_models):
+        name = f'{shape}_{i}'
+        model_id = 'item/' + name
+        is_block = shape in (PACK_SHAPE_PARENTS, PACK_SHAPE_ELEMENTS, PACK_SHAPE_TEXTURES)
+        texture_id = ('block/' if is_block else 'item/') + name
+        if shape == PACK_SHAPE_TEXTURES:
+            for face in FACES:
+                write_texture(os.path.join(textures_path, *texture_id.split('/')) + f'_{face}.png', rng, texture_size)
+        else:
+            write_texture(os.path.join(textures_path, *texture_id.split('/')) + '.png', rng, texture_size,
+                          num_frames if shape == PACK_SHAPE_ANIMATED else 1)
+
+        if shape == PACK_SHAPE_PARENTS:
+            # Every model gets its own chain, so each one is parsed all the way up
+            parent = 'block/block'
+            for level in range(parent_depth):
+                chain_id = f'block/{name}_{level}'
+                chain = {'parent': parent, 'textures': {f'level_{level}': texture_id}}
+                if level == 0:
+                    chain['elements'] = [{'from': [0, 0, 0], 'to': [16, 16, 16],
+                                          'faces': {face: {'texture': '#all'} for face in FACES}}]
+                    chain['textures']['particle'] = '#all'
+                if level % 2 == 1:
+                    chain['display'] = BLOCK_GUI_DISPLAY
+                write_json(os.path.join(models_path, *chain_id.split('/')) + '.json', chain)
+                parent = chain_id
+            model = {'parent': parent, 'textures': {'all': texture_id}}
+        elif shape == PACK_SHAPE_ELEMENTS:
+            model = {'parent': 'block/block', 'textures': {'all': texture_id},
+                     'elements': [get_element(rng) for _ in range(num_elements)]}
+        elif shape == PACK_SHAPE_TEXTURES:
+            model = {'parent': 'block/block', 'textures': {face: f'{texture_id}_{face}' for face in FACES},
+                     'elements': [get_element(rng, None) for _ in range(num_elements)]}
+        else:
+            model = {'parent': 'item/generated', 'textures': {'layer0': texture_id}}
+
+        if shape == PACK_SHAPE_ANIMATED:
+            mcmeta = {'animation': {'frametime': int(rng.integers(1, 5))}}
+            write_json(os.path.join(textures_path, *texture_id.split('/')) + '.png.mcmeta', mcmeta)
+
+        write_json(os.path.join(models_path, *model_id.split('/')) + '.json', model)
+
+        out_names = [name]
+        override_name = FACES[0] if shape == PACK_SHAPE_TEXTURES else 'layer0'
+        out_names += [{'name': f'{name}_variant_{k}', 'texture_overrides': {override_name: override_texture}}
+                      for k, override_texture in enumerate(override_textures)]
+        file_name_map[model_id] = out_names
+        pack.num_renders += len(out_names)
+
+    pack.num_models = num_models
+    write_json(pack.map_file, file_name_map)
+    return pack
@@ -0,0 +1,112 @@
+import os
+
+import numpy
+
+from helper.atlas import pack_shelves
+from helper.textures import get_texture_cache
+
+DEFAULT_TEXTURE_ATLAS_SIZE = 4096
+
+
+def next_power_of_two(value):
+    power = 1
+    while power < value:
+        power *= 2
+    return power
+
+
+def fits_texture_atlas(texture_paths, max_size=DEFAULT_TEXTURE_ATLAS_SIZE):
+    '''
+    :return: Whether the textures fit in a single texture atlas of at most max_size square
+    '''
+    textures = [get_texture_cache().get(os.path.abspath(path)) for path in set(texture_paths)]
+    placements = pack_shelves([(texture.getXSize(), texture.getYSize()) for texture in textures], max_size)
+    return all(sheet == 0 for sheet, _, _ in placements)
+
+
+def build_texture_atlases(texture_path_groups, max_size=DEFAULT_TEXTURE_ATLAS_SIZE):
+    '''
+    Packs consecutive groups of textures into shared texture atlases, each taking as many groups as fit, so the
+    geometry of every group in an atlas can keep it bound.
+    :param texture_path_groups: List of sets of texture paths
+    :return: List of the TextureAtlas of every group; None for groups that don't fit in a texture atlas on their own
+    '''
+    atlases = []
+    texture_paths = set()
+    num_groups = 0  # Groups since the last atlas was built, waiting for theirs
+    for group in texture_path_groups:
+        if num_groups > 0 and fits_texture_atlas(texture_paths | group, max_size):
+            texture_paths |= group
+            num_groups += 1
+            continue
+
+        if num_groups > 0:
+            atlases += [TextureAtlas(texture_paths, max_size)] * num_groups
+        if fits_texture_atlas(group, max_size):
+            texture_paths = set(group)
+            num_groups = 1
+        else:
+            atlases.append(None)
+            texture_paths = set()
+            num_groups = 0
+
+    if num_groups > 0:
+        atlases += [TextureAtlas(texture_paths, max_size)] * num_groups
+    return atlases
+
+
+class TextureAtlas:
+    '''
+    Packs a set of texture files into a single panda texture, so geometry using any of them can share one texture
+    state (see build_model_node). Textures are packed exactly as panda loads them (see TextureCache), and the atlas
+    itself is a power of two in size, so remapped uvs land on the same texels; only where a uv falls right on the edge
+    between two texels can the software renderer round it to the other one, since it samples the bigger texture with
+    less sub-texel precision.
+    '''
+
+    def __init__(self, texture_paths, max_size=DEFAULT_TEXTURE_ATLAS_SIZE):
+        texture_paths = sorted(set(os.path.abspath(path) for path in texture_paths))
+        textures = [get_texture_cache().get(path) for path in texture_paths]
+        sizes = [(texture.getXSize(), texture.getYSize()) for texture in textures]
+
+        placements = pack_shelves(sizes, max_size)
+        if any(sheet != 0 for sheet, _, _ in placements):
+            raise Exception(f'Textures don\'t fit in a {max_size}x{max_size} texture atlas')
+
+        self.width = next_power_of_two(max([x + width for (_, x, _), (width, _) in zip(placements, sizes)] + [1]))
+        self.height = next_power_of_two(max([y + height for (_, _, y), (_, height) in zip(placements, sizes)] + [1]))
+        self.rects = {}  # Map of absolute texture path to (x, y, width, height) in texels; y counts from the bottom
+
+        # Panda images are stored bottom row first, so rows are filled from the bottom of the atlas up
+        texels = numpy.zeros((self.height, self.width, 4), dtype=numpy.uint8)
+        for path, texture, (_, x, y), (width, height) in zip(texture_paths, textures, placements, sizes):
+            image = numpy.frombuffer(texture.getRamImageAs('RGBA'), dtype=numpy.uint8).reshape((height, width, 4))
+            texels[y:y + height, x:x + width] = image
+            self.rects[path] = (x, y, width, height)
+
+        from panda3d.core import Texture
+
+        self.texture = Texture('atlas')
+        self.texture.setup2dTexture(self.width, self.height, Texture.T_unsigned_byte, Texture.F_rgba)
+        self.texture.setRamImageAs(texels.tobytes(), 'RGBA')
+        self.texture.setMinfilter(Texture.FT_nearest)
+        self.texture.setMagfilter(Texture.FT_nearest)
+
+    def has_texture(self, texture_path):
+        return os.path.abspath(texture_path) in self.rects
+
+    def get_uv_transform(self, texture_path):
+        '''
+        :return: Tuple (u scale, v scale, u offset, v offset) that maps uvs of the texture to uvs of the atlas
+        '''
+        x, y, width, height = self.rects[os.path.abspath(texture_path)]
+        return width / self.width, height / self.height, x / self.width, y / self.height
+
+    def remap_uvs(self, texture_path, u, v):
+        '''
+        :param u: Array of u coordinates into the texture; must be within 0 to 1, since the atlas can't repeat textures
+        :param v: Array of v coordinates into the texture
+        :return: Tuple of the u and v arrays, mapped into the atlas
+        '''
+        u_scale, v_scale, u_offset, v_offset = self.get_uv_transform(texture_path)
+        return u_offset + u * u_scale, v_offset + v * v_scale
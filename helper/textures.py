@@ -0,0 +1,92 @@
+import hashlib
+import os
+from collections import OrderedDict
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from panda3d.core import Texture
+
+DEFAULT_TEXTURE_CACHE_BUDGET = 256 * 1024 * 1024
+
+
+class TextureCache:
+    '''
+    Process-wide cache of panda textures. Files are loaded once and deduplicated by content hash, so byte-identical
+    images share a single Texture. Once the textures take up more than the memory budget, the least recently used
+    ones are evicted.
+    '''
+
+    def __init__(self, budget_bytes=DEFAULT_TEXTURE_CACHE_BUDGET):
+        self.budget_bytes = budget_bytes
+        self.used_bytes = 0
+        self.path_hashes = {}  # Map of absolute file path to tuple (mtime, content hash)
+        self.textures = OrderedDict()  # Map of content hash to Texture, least recently used first
+
+    def get(self, texture_path) -> 'Texture':
+        texture_path = os.path.abspath(texture_path)
+        mtime = os.stat(texture_path).st_mtime_ns
+
+        data = None
+        cached_hash = self.path_hashes.get(texture_path)
+        if cached_hash is not None and cached_hash[0] == mtime:
+            content_hash = cached_hash[1]
+        else:
+            data = self.read_file(texture_path)
+            content_hash = hashlib.sha1(data).hexdigest()
+            self.path_hashes[texture_path] = (mtime, content_hash)
+
+        texture = self.textures.get(content_hash)
+        if texture is not None:
+            self.textures.move_to_end(content_hash)
+            return texture
+
+        if data is None:
+            data = self.read_file(texture_path)
+
+        texture = self.decode(data, texture_path)
+        self.textures[content_hash] = texture
+        self.used_bytes += texture.estimateTextureMemory()
+        self.evict()
+
+        return texture
+
+    def evict(self):
+        # Always keep the most recent texture, even if it is over the budget on its own
+        while self.used_bytes > self.budget_bytes and len(self.textures) > 1:
+            _, texture = self.textures.popitem(last=False)
+            self.used_bytes -= texture.estimateTextureMemory()
+
+    def clear(self):
+        self.path_hashes.clear()
+        self.textures.clear()
+        self.used_bytes = 0
+
+    @staticmethod
+    def read_file(texture_path):
+        with open(texture_path, 'rb') as texture_file:
+            return texture_file.read()
+
+    @staticmethod
+    def decode(data, texture_path):
+        # Imported here, so only loading a texture loads panda
+        from panda3d.core import PNMImage, StringStream, Texture
+
+        image = PNMImage()
+        if not image.read(StringStream(data)):
+            raise Exception('Failed to load texture ' + texture_path)
+
+        texture = Texture(os.path.basename(texture_path))
+        # Rescale the same way the texture pool would, e.g. non power of two animation strips
+        texture.considerRescale(image)
+        texture.load(image)
+        texture.setFormat(Texture.F_rgba)
+        texture.setMinfilter(Texture.FT_nearest)
+        texture.setMagfilter(Texture.FT_nearest)
+        return texture
+
+
+texture_cache = TextureCache()
+
+
+def get_texture_cache() -> TextureCache:
+    return texture_cache
@@ -24,7 +24,7 @@ filename_to_tint = {
 
 
 def find_leaf_tint(json_ids):
-    ids_copy = json_ids
+    ids_copy = list(json_ids)
     ids_copy.reverse()
 
     for json_id in ids_copy:
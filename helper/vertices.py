@@ -0,0 +1,137 @@
+import math
+
+import numpy
+
+from helper.model import MinecraftModel, ModelJSON
+from helper.tints import find_leaf_tint
+
+SCALE_ROTATION_22_5 = 1 / math.cos(math.pi / 8)
+SCALE_ROTATION_GENERAL = 1 / math.cos(math.pi / 4)
+
+FACE_NAMES = ['up', 'down', 'north', 'east', 'south', 'west']
+
+# Corners of every face, in FACE_NAMES order; 0 picks the coordinate from "from", 1 the one from "to"
+FACE_CORNERS = numpy.array([
+    [[0, 1, 0], [1, 1, 0], [0, 1, 1], [1, 1, 1]],  # Up
+    [[0, 0, 1], [1, 0, 1], [0, 0, 0], [1, 0, 0]],  # Down
+    [[1, 1, 0], [0, 1, 0], [1, 0, 0], [0, 0, 0]],  # North
+    [[1, 1, 1], [1, 1, 0], [1, 0, 1], [1, 0, 0]],  # East
+    [[0, 1, 1], [1, 1, 1], [0, 0, 1], [1, 0, 1]],  # South
+    [[0, 1, 0], [0, 1, 1], [0, 0, 0], [0, 0, 1]],  # West
+], dtype=bool)
+
+# Index into the face's uvs of the (u, v) of every corner; the same for every face
+CORNER_UVS = numpy.array([[0, 1], [2, 1], [0, 3], [2, 3]])
+
+# Order the corner uvs get picked in for every face rotation
+UV_ROTATION_90 = numpy.array([2, 0, 3, 1])
+UV_ROTATIONS = {
+    90: UV_ROTATION_90,
+    180: UV_ROTATION_90[UV_ROTATION_90],
+    270: UV_ROTATION_90[UV_ROTATION_90][UV_ROTATION_90],
+}
+NO_UV_ROTATION = numpy.arange(4)
+
+AXES = {'x': 0, 'y': 1}  # Anything else rotates around z
+
+
+def get_minecraft_model(base_path, model_json: ModelJSON, filename):
+    model = MinecraftModel()
+    model.positions, model.uvs, model.quad_textures, model.quad_tinted = get_quads_for_model(model_json)
+    model.textures = {val.name: [val.texture_ref, False] for val in model_json.textures}
+
+    # Set tinted property if any cube has tinted set
+    tinted_textures = set(texture for texture, tinted in zip(model.quad_textures, model.quad_tinted) if tinted)
+    for texture in tinted_textures:
+        if texture[1:] in model.textures:
+            model.textures[texture[1:]] = [model.textures[texture[1:]][0], find_leaf_tint(model_json.full_id_path)]
+
+    return model
+
+
+def get_element_matrix(rotation):
+    '''
+    :return: Matrix that rotates (and rescales, if the element asks for it) a position relative to the rotation origin
+    '''
+    cos = math.cos(math.radians(rotation.angle))
+    sin = math.sin(math.radians(rotation.angle))
+    axis = AXES.get(rotation.axis, 2)
+
+    if axis == 0:
+        matrix = numpy.array([[1, 0, 0], [0, cos, -sin], [0, sin, cos]])
+    elif axis == 1:
+        matrix = numpy.array([[cos, 0, sin], [0, 1, 0], [-sin, 0, cos]])
+    else:
+        matrix = numpy.array([[cos, -sin, 0], [sin, cos, 0], [0, 0, 1]])
+
+    if rotation.rescale:
+        scale = SCALE_ROTATION_22_5 if math.fabs(math.fabs(rotation.angle) - 22.5) < 0.01 else SCALE_ROTATION_GENERAL
+        scales = numpy.full(3, scale)
+        scales[axis] = 1
+        matrix = matrix * scales[:, numpy.newaxis]
+
+    return matrix
+
+
+def get_quads_for_model(model_json: ModelJSON):
+    '''
+    Expands every face of every element into a quad.
+    :return: Tuple of the (N, 4, 3) corner positions, centered on the origin, the (N, 4, 2) corner uvs, scaled to 0-1
+    with v pointing up, the list of the texture reference ('#name') of every quad, and the (N,) tinted flag of every quad
+    '''
+    bounds = []  # (from, to) of the element of every face
+    face_indices = []
+    face_uvs = []
+    uv_rotations = []
+    textures = []
+    tinted = []
+    matrices = []
+    origins = []
+    axes = []
+
+    for element in model_json.elements:
+        element_faces = [(i, element.faces[name]) for i, name in enumerate(FACE_NAMES) if name in element.faces]
+        if len(element_faces) == 0:
+            continue
+
+        matrix = get_element_matrix(element.rotation)
+        # Once one face of an element is tinted, every face after it is as well
+        element_tinted = False
+        for face_index, face in element_faces:
+            element_tinted = element_tinted or face.tint_index is not None
+
+            bounds.append((element.voxel_from, element.voxel_to))
+            face_indices.append(face_index)
+            face_uvs.append(face.uvs)
+            uv_rotations.append(UV_ROTATIONS.get(face.rotation, NO_UV_ROTATION))
+            textures.append(face.texture)
+            tinted.append(element_tinted)
+            matrices.append(matrix)
+            origins.append(element.rotation.origin)
+            axes.append(AXES.get(element.rotation.axis, 2))
+
+    if len(textures) == 0:
+        return numpy.zeros((0, 4, 3)), numpy.zeros((0, 4, 2)), [], numpy.zeros(0, dtype=bool)
+
+    bounds = numpy.array(bounds, dtype=numpy.float64)
+    corners = FACE_CORNERS[face_indices]
+    positions = numpy.where(corners, bounds[:, numpy.newaxis, 1, :], bounds[:, numpy.newaxis, 0, :])
+
+    origins = numpy.array(origins, dtype=numpy.float64)[:, numpy.newaxis, :]
+    rotated = numpy.matmul(positions - origins, numpy.array(matrices).transpose(0, 2, 1)) + origins
+    # Keep the coordinate along the rotation axis exactly as it was
+    axis_mask = numpy.arange(3) == numpy.array(axes)[:, numpy.newaxis]
+    positions = numpy.where(axis_mask[:, numpy.newaxis, :], positions, rotated)
+
+    face_uvs = numpy.array(face_uvs, dtype=numpy.float64)
+    uv_order = CORNER_UVS[numpy.array(uv_rotations)]
+    uvs = numpy.take_along_axis(face_uvs[:, numpy.newaxis, :], uv_order.reshape(len(textures), 8)[:, numpy.newaxis, :],
+                                axis=2).reshape(len(textures), 4, 2)
+    # In MC's json files, UV coords are between 0 and 16 with v pointing down, here we scale them so they are between
+    # 0 and 1 with v pointing up
+    uvs[:, :, 1] = 16 - uvs[:, :, 1]
+    uvs /= 16
+
+    positions -= 8
+
+    return positions, uvs, textures, numpy.array(tinted, dtype=bool)
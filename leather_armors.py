@@ -1,92 +1,192 @@
+import io
 import json
+import multiprocessing
 import os
 
-import PIL
-from PIL import Image
-
+from helper.leather import color_tuple_from_hexcode, generate_image
+from helper.model import fill_frame_data, load_model_json
 from helper.options import parse_render_leather_armors_options
+from helper.scaling import downscale
 
 options = parse_render_leather_armors_options()
-
-
-def color_tuple_from_hexcode(hexcode):
-    return int(hexcode[1:3], 16), int(hexcode[3:5], 16), int(hexcode[5:7], 16)
-
-
-def generate_outputs_for_definition(definition):
-    color_tuple = color_tuple_from_hexcode(definition["color"])
-
-    if "icon_relative_path" in definition and definition["icon_relative_path"] != "":
-        piece_colormap = os.path.join(options.rsp_path, definition["icon_relative_path"])
+renderer = None  # Created on first use with --render, then shared by every icon rendered in this process
+models = {}  # Map of model id to the model json loaded for --render; kept, so the renderer can tell it is still loaded
+
+# Flat icon models (see /extra) for --render: the tinted colormap as layer0, and the overlay as layer1
+LEATHER_ARMOR_MODEL = 'builtin/leather_armor'
+LEATHER_ARMOR_OVERLAY_MODEL = 'builtin/leather_armor_overlay'
+DEFAULT_RENDER_SIZE = 128
+
+# Tints of the same colormap and overlay get handed to a worker together, so it only decodes them once
+TINTS_PER_JOB = 32
+
+
+def get_piece_path(definition, key):
+    if key in definition and definition[key] != "":
+        return os.path.join(options.rsp_path, definition[key])
+    return None
+
+
+def get_model_id(piece_colormap, piece_overlay):
+    '''
+    :return: Id of the model to render a piece with; None if there is neither a colormap nor an overlay
+    '''
+    if piece_colormap is None and piece_overlay is None:
+        return None
+    return LEATHER_ARMOR_OVERLAY_MODEL if piece_colormap is not None and piece_overlay is not None \
+        else LEATHER_ARMOR_MODEL
+
+
+def get_jobs(armor_descriptions):
+    '''
+    Merges descriptions that would give the same icon, and groups them by colormap and overlay. Tinting in 2D, every
+    job gets up to TINTS_PER_JOB tints of one colormap and overlay. With --render, every job gets the pieces of one
+    model instead, split over at most one job per worker, so a worker loads each model once and then only swaps the
+    textures and tint.
+    :return: List of jobs, each a list of tuple (colormap path, overlay path, list of tuple (color tuple, list of output
+    files))
+    '''
+    outputs = {}  # Map of (colormap path, overlay path) to map of color tuple to list of output files
+    for definition in armor_descriptions:
+        piece_colormap = get_piece_path(definition, "icon_relative_path")
+        piece_overlay = get_piece_path(definition, "overlay_relative_path")
+        output_name = os.path.join(options.output_path, definition["name"]) + '.png'
+
+        colors = outputs.setdefault((piece_colormap, piece_overlay), {})
+        colors.setdefault(color_tuple_from_hexcode(definition["color"]), []).append(output_name)
+
+    jobs = []
+    if options.render:
+        pieces_by_model = {}  # Map of model id to list of tuple (colormap path, overlay path, list of tints)
+        for (piece_colormap, piece_overlay), colors in outputs.items():
+            pieces_by_model.setdefault(get_model_id(piece_colormap, piece_overlay), []).append(
+                (piece_colormap, piece_overlay, list(colors.items())))
+        for pieces in pieces_by_model.values():
+            num_jobs = min(max(options.jobs, 1), len(pieces))
+            jobs += [pieces[i::num_jobs] for i in range(num_jobs)]
+        return jobs
+
+    for (piece_colormap, piece_overlay), colors in outputs.items():
+        tints = list(colors.items())
+        for i in range(0, len(tints), TINTS_PER_JOB):
+            jobs.append([(piece_colormap, piece_overlay, tints[i:i + TINTS_PER_JOB])])
+
+    return jobs
+
+
+def get_renderer():
+    global renderer
+    if renderer is None:
+        # Imported here, so tinting in 2D doesn't need panda
+        from helper.renderer import Renderer
+
+        size = options.superscale_size or options.scale or DEFAULT_RENDER_SIZE
+        renderer = Renderer(size, [options.rsp_path], options.rsp_path)
+
+    return renderer
+
+
+def get_model(model_id):
+    if model_id not in models:
+        model = load_model_json(model_id, [options.rsp_path], options.rsp_path)
+        fill_frame_data(model, [options.rsp_path], options.rsp_path)
+        models[model_id] = model
+    return models[model_id]
+
+
+def render_images(color_tuples, piece_colormap, piece_overlay):
+    '''
+    Renders the icons through the 3D renderer. The model is only loaded if the renderer doesn't have it loaded yet;
+    the textures of the piece get swapped in, and only the tint changes for every color.
+    :return: List of the icon of every color; None if there is neither a colormap nor an overlay
+    '''
+    model_id = get_model_id(piece_colormap, piece_overlay)
+    if model_id is None:
+        return [None] * len(color_tuples)
+
+    if model_id == LEATHER_ARMOR_OVERLAY_MODEL:
+        texture_overrides = {'layer0': piece_colormap, 'layer1': piece_overlay}
     else:
-        piece_colormap = None
-
-    if "overlay_relative_path" in definition and definition["overlay_relative_path"] != "":
-        piece_overlay = os.path.join(options.rsp_path, definition["overlay_relative_path"])
-    else:
-        piece_overlay = None
-
-    output_name = os.path.join(options.output_path, definition["name"]) + '.png'
-
-    generate_image(color_tuple, piece_colormap, piece_overlay, output_name)
-
-
-def generate_image(color_tuple, input_image_path, overlay_image_path, output_image_path):
-    if input_image_path is not None and overlay_image_path is not None:
-        with Image.open(input_image_path) as input_image:
-            with Image.open(overlay_image_path) as overlay_image:
-                bands = input_image.convert('RGBA').split()
-                R, G, B, A = 0, 1, 2, 3
-                r_band = bands[R].point(lambda x: round((x / 255) * color_tuple[0]))
-                g_band = bands[G].point(lambda x: round((x / 255) * color_tuple[1]))
-                b_band = bands[B].point(lambda x: round((x / 255) * color_tuple[2]))
-
-                image_out = Image.merge('RGBA', [r_band, g_band, b_band, bands[A]])
-
-                if image_out.width != overlay_image.width or image_out.height != overlay_image.height:
-                    image_out = image_out.resize((overlay_image.width, overlay_image.height), resample=PIL.Image.BICUBIC)
-
-                image_out = Image.alpha_composite(image_out, overlay_image.convert('RGBA'))
-
-                if options.scale is not None:
-                    resample_method = PIL.Image.NEAREST if image_out.width <= options.scale else PIL.Image.BICUBIC
-                    image_out = image_out.resize((options.scale, options.scale), resample=resample_method)
-
-                image_out.save(output_image_path)
-    elif input_image_path is not None:
-        with Image.open(input_image_path) as input_image:
-            bands = input_image.convert('RGBA').split()
-            R, G, B, A = 0, 1, 2, 3
-            r_band = bands[R].point(lambda x: round((x / 255) * color_tuple[0]))
-            g_band = bands[G].point(lambda x: round((x / 255) * color_tuple[1]))
-            b_band = bands[B].point(lambda x: round((x / 255) * color_tuple[2]))
-
-            image_out = Image.merge('RGBA', [r_band, g_band, b_band, bands[A]])
-
-            if options.scale is not None:
-                resample_method = PIL.Image.NEAREST if image_out.width <= options.scale else PIL.Image.BICUBIC
-                image_out = image_out.resize((options.scale, options.scale), resample=resample_method)
-
-            image_out.save(output_image_path)
-        pass
-    elif overlay_image_path is not None:
-        with Image.open(overlay_image_path) as overlay_image:
-            image_out = overlay_image
-            if options.scale is not None:
-                resample_method = PIL.Image.NEAREST if image_out.width <= options.scale else PIL.Image.BICUBIC
-                image_out = image_out.resize((options.scale, options.scale), resample=resample_method)
-
-            image_out.save(output_image_path)
-        pass
+        texture_overrides = {'layer0': piece_colormap if piece_colormap is not None else piece_overlay}
+
+    model = get_model(model_id)
+    current_renderer = get_renderer()
+    if current_renderer.model is not model:
+        current_renderer.load(model, 'gui', False, texture_overrides)
+
+    images = []
+    for color_tuple in color_tuples:
+        # An overlay on its own isn't tinted
+        image = current_renderer.render_variant(texture_overrides, color_tuple if piece_colormap is not None else None)
+        if options.superscale_size is not None and options.scale is not None:
+            image = downscale(image, options.scale)
+        images.append(image)
+
+    return images
+
+
+def generate_outputs(job):
+    '''
+    :param job: See get_jobs
+    :return: Number of icons written
+    '''
+    return sum(generate_piece_outputs(piece_colormap, piece_overlay, tints)
+               for piece_colormap, piece_overlay, tints in job)
+
+
+def generate_piece_outputs(piece_colormap, piece_overlay, tints):
+    '''
+    :param tints: List of tuple (color tuple, list of output files)
+    :return: Number of icons written
+    '''
+    images = None
+    if options.render:
+        try:
+            images = render_images([color_tuple for color_tuple, _ in tints], piece_colormap, piece_overlay)
+        except Exception as e:
+            print(f'Failed to render {piece_colormap or piece_overlay}: {e}')
+            return 0
+
+    written = 0
+    for i, (color_tuple, output_names) in enumerate(tints):
+        print("Generating icon for " + ', '.join(os.path.basename(output_name) for output_name in output_names))
+        if images is not None:
+            image_out = images[i]
+        else:
+            try:
+                image_out = generate_image(color_tuple, piece_colormap, piece_overlay, options.scale)
+            except Exception as e:
+                print(f'Failed to generate {", ".join(output_names)}: {e}')
+                continue
+        if image_out is None:
+            continue
+
+        # Encode once, then write the same bytes to every description that asked for this icon
+        encoded = io.BytesIO()
+        image_out.save(encoded, format='PNG')
+        for output_name in output_names:
+            with open(output_name, 'wb') as out:
+                out.write(encoded.getvalue())
+        written += len(output_names)
+
+    return written
 
 
 def main():
     with open(options.description_file, 'r') as desc_file:
         armor_descriptions = json.load(desc_file)
 
-    for desc in armor_descriptions:
-        print("Generating icon for " + desc["name"])
-        generate_outputs_for_definition(desc)
+    os.makedirs(options.output_path, exist_ok=True)
+    jobs = get_jobs(armor_descriptions)
+
+    if options.jobs > 1 and len(jobs) > 1:
+        with multiprocessing.Pool(options.jobs) as pool:
+            written = sum(pool.imap_unordered(generate_outputs, jobs))
+    else:
+        written = sum(map(generate_outputs, jobs))
+
+    print(f'Generated {written} of {len(armor_descriptions)} icons')
 
 
-main()
+if __name__ == '__main__':
+    main()